@@ -16,6 +16,29 @@ int _timer = 0;       // incremental counter for no data
 // incoming chord data
 char _byte = 0;
 
+// framed link (tools/ledlink.py): [sync][seq << 4 | kind][length][payload][crc-8]
+//   chord:  [color byte]
+//   key:    [groups][4-bit levels, two per byte, low nibble first]
+//   delta:  [bit per group, set where the level changed][changed 4-bit levels, two per byte]
+//   single chord bytes keep working until the first frame arrives
+#define FRAME_SYNC  0xA5
+#define FRAME_CHORD 0x01
+#define FRAME_KEY   0x02
+#define FRAME_DELTA 0x03
+#define MAX_GROUPS  48
+#define MAX_PAYLOAD 30  // a delta of every group: (48 + 7) / 8 + 48 / 2
+bool _framed = false;
+uint8_t _levels[MAX_GROUPS];
+uint8_t _groups = 0;    // 0 until a key frame, then per pixel intensities are shown
+int8_t _seq = -1;       // sequence of the last applied level frame, -1 waits for a key frame
+// parser state
+uint8_t _state = 0;     // 0: sync, 1: type, 2: length, 3: payload, 4: crc
+uint8_t _type = 0;
+uint8_t _length = 0;
+uint8_t _received = 0;
+uint8_t _crc = 0;
+uint8_t _payload[MAX_PAYLOAD];
+
 // chord/color delay parameters
 uint8_t STD_FADE = 0;
 uint8_t MAJ_FADE = 0;
@@ -217,6 +240,7 @@ uint32_t get_color(char _byte) {
         return get_color_chord( 86,  46, 145, MIN_FADE);
     }
   }
+  return 0;
 }
 
 
@@ -261,12 +285,157 @@ void colorFade(int strip, uint32_t color, uint8_t wait) {
 }
 
 
+// Sets every pixel to its group's level of the chord color, or of a color wheel without a chord
+void levelFade(int strip, uint8_t wait) {
+  uint32_t _chord = _byte > 0 ? get_color(_byte) : 0;
+  int _px = strip0.numPixels();
+  for (int i = 0; i < _px; i++) {
+    uint8_t _group = (uint32_t)i * _groups / _px;
+    uint32_t _color = _chord ? _chord : Wheel(_group * 256 / _groups);
+    uint16_t _level = _levels[_group];
+    uint32_t _scaled = Color(((_color >> 16) & 0xFF) * _level / 15,
+                             ((_color >>  8) & 0xFF) * _level / 15,
+                             ( _color        & 0xFF) * _level / 15);
+    switch (strip) {
+      case 0:
+        strip0.setPixelColor(i, _scaled);
+        break;
+      case 1:
+        strip1.setPixelColor(i, _scaled);
+        break;
+      case 2:
+        strip2.setPixelColor(i, _scaled);
+        break;
+      case 3:
+        strip3.setPixelColor(i, _scaled);
+        break;
+    }
+  }
+  switch (strip) {
+    case 0:
+      strip0.show();
+      break;
+    case 1:
+      strip1.show();
+      break;
+    case 2:
+      strip2.show();
+      break;
+    case 3:
+      strip3.show();
+      break;
+  }
+  delay(wait);
+}
+
+
+// CRC-8, polynomial 0x07, one byte at a time
+uint8_t crc8(uint8_t crc, uint8_t data) {
+  crc ^= data;
+  for (uint8_t i = 0; i < 8; i++) {
+    crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : (crc << 1);
+  }
+  return crc;
+}
+
+
+// 4-bit level `index` of nibble packed bytes
+uint8_t get_level(uint8_t *packed, uint8_t index) {
+  return (packed[index >> 1] >> (4 * (index & 1))) & 0x0F;
+}
+
+
+// Applies a frame that checked out
+void apply_frame() {
+  uint8_t _kind = _type & 0x0F;
+  int8_t _frame_seq = _type >> 4;
+  _framed = true;
+  _timer = 0;
+  switch (_kind) {
+    case FRAME_CHORD:
+      if (_length == 1)
+        _byte = _payload[0];
+      break;
+    case FRAME_KEY:
+      if (_length > 0 && _payload[0] <= MAX_GROUPS && _length == 1 + (_payload[0] + 1) / 2) {
+        _groups = _payload[0];
+        for (uint8_t i = 0; i < _groups; i++)
+          _levels[i] = get_level(_payload + 1, i);
+        _seq = _frame_seq;
+      }
+      break;
+    case FRAME_DELTA: {
+      // a delta only applies on top of the previous level frame, otherwise wait for the next key frame
+      uint8_t _mask = (_groups + 7) / 8;
+      uint8_t _changed = 0;
+      if (_seq < 0 || _frame_seq != ((_seq + 1) & 0x0F) || _length < _mask) {
+        _seq = -1;
+        break;
+      }
+      for (uint8_t i = 0; i < _groups; i++)
+        _changed += (_payload[i >> 3] >> (i & 7)) & 1;
+      if (_length != _mask + (_changed + 1) / 2) {
+        _seq = -1;
+        break;
+      }
+      _changed = 0;
+      for (uint8_t i = 0; i < _groups; i++) {
+        if ((_payload[i >> 3] >> (i & 7)) & 1)
+          _levels[i] = get_level(_payload + _mask, _changed++);
+      }
+      _seq = _frame_seq;
+      break;
+    }
+  }
+}
+
+
+// Frame parser state machine, one incoming byte at a time
+void parse_byte(uint8_t _in) {
+  switch (_state) {
+    case 0:
+      if (_in == FRAME_SYNC) {
+        _state = 1;
+      } else if (!_framed && (char)_in > 0) {
+        // single chord byte
+        _byte = _in;
+        _timer = 0;
+      }
+      break;
+    case 1:
+      _type = _in;
+      _crc = crc8(0, _in);
+      _state = 2;
+      break;
+    case 2:
+      if (_in > MAX_PAYLOAD) {
+        _state = 0;
+        break;
+      }
+      _length = _in;
+      _received = 0;
+      _crc = crc8(_crc, _in);
+      _state = _length ? 3 : 4;
+      break;
+    case 3:
+      _payload[_received++] = _in;
+      _crc = crc8(_crc, _in);
+      if (_received == _length)
+        _state = 4;
+      break;
+    case 4:
+      _state = 0;
+      if (_in == _crc)
+        apply_frame();
+      break;
+  }
+}
+
+
 // Reads data from serial port and stores
 void read_data() {
-  if (Serial.available() > 0) {
-    _byte = Serial.read();
-    if (_byte > 0)
-      _timer = 0;
+  while (Serial.available() > 0) {
+    parse_byte(Serial.read());
   }
 }
 
@@ -284,7 +453,9 @@ void loop() {
       read_data();
     }
   }
-  if (_timer < trigger) {
+  if (_timer < trigger && _groups > 0) {
+    levelFade(0, _delay);
+  } else if (_timer < trigger) {
     uint32_t _color = get_color(_byte);
     colorFade(0, _color, _delay);
 //    colorFade(1, _color, _delay);
@@ -1,4 +1,12 @@
 from .capture import AudioCapture
 from .filter import TriadFilter
-from .graph import QtCore, PlotSignalWindow
-from .log import logger, set_level
\ No newline at end of file
+from .log import logger, set_level
+from .templates import TemplateFilter
+
+
+def __getattr__(name: str):
+    # the Qt / pyqtgraph stack is only imported once a window is asked for
+    if name in ('QtCore', 'PlotSignalWindow'):
+        from . import graph
+        return getattr(graph, name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
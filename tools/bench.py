@@ -0,0 +1,236 @@
+from json import dump, load
+from numpy import arange, clip, float64, int16, ndarray, percentile, pi, sin, zeros
+from numpy.random import default_rng
+from time import perf_counter
+from tracemalloc import get_traced_memory, is_tracing, reset_peak, start as trace_start, stop as trace_stop
+from .capture import NoteBankEngine, SpectrumEngine
+from .filter import TriadFilter
+from .gate import ChangeGate
+from .log import logger
+from .templates import TemplateFilter
+
+
+# semitone intervals above the root
+TRIADS = {
+    'maj': (0, 4, 7),
+    'm': (0, 3, 7),
+    'dim': (0, 3, 6)
+}
+ROOTS = ['A', 'A♯|B♭', 'B', 'C', 'C♯|D♭', 'D', 'D♯|E♭', 'E', 'F', 'F♯|G♭', 'G', 'G♯|A♭']
+
+
+def synth_signal(size: int, bitrate: int, freqs=(440.0, 554.37, 659.26), amplitude=8000., noise=0.05,
+                 seed=0, harmonics=1) -> ndarray:
+    _t = arange(size, dtype=float64) / bitrate
+    _y = zeros(size, dtype=float64)
+    for f in freqs:
+        for h in range(1, harmonics + 1):
+            if h * f < 0.5 * bitrate:
+                _y += sin(2 * pi * h * f * _t) / h
+    _y *= amplitude / max(len(freqs), 1)
+    if noise:
+        _y += default_rng(seed).normal(0., noise * amplitude, size)
+    return clip(_y, -32768, 32767).astype(int16)
+
+
+def synth_triad(semitone: int, kind: str, size: int, bitrate: int, harmonics=4, detune=10., noise=0.05,
+                seed=0) -> ndarray:
+    # `semitone` counts from A4, `detune` is the maximum random offset in cents per note
+    _rng = default_rng(seed)
+    _freqs = [440.0 * 2 ** ((semitone + i + _rng.uniform(-detune, detune) / 100.) / 12.) for i in TRIADS[kind]]
+    return synth_signal(size, bitrate, _freqs, noise=noise, seed=seed, harmonics=harmonics)
+
+
+def frames_per_sec(func, data: ndarray, frames=200, warmup=5) -> float:
+    for _ in range(warmup):
+        func(data)
+    _start = perf_counter()
+    for _ in range(frames):
+        func(data)
+    return frames / (perf_counter() - _start)
+
+
+def benchmark_fft(audio, size=None, frames=200, **kwargs) -> dict:
+    _size = int(size or audio.window_size)
+    _data = synth_signal(_size, audio.bitrate)
+    _results = {
+        'size': _size,
+        'complex_fft': frames_per_sec(lambda d: audio.complex_fft(d, **kwargs), _data, frames),
+        'fft': frames_per_sec(lambda d: audio.fft(d, **kwargs), _data, frames)
+    }
+    _results['speedup'] = _results['fft'] / _results['complex_fft']
+    logger.info('fft %(size)d: complex_fft %(complex_fft).1f fps, fft %(fft).1f fps, speedup %(speedup).2fx',
+                _results)
+    return _results
+
+
+class BenchmarkSuite:
+    # synthetic triads from A1 upwards, fed through the spectrum -> TriadFilter path
+    def __init__(self, size=8192, bitrate=48100, threshold=2e+4, db_gain=1e-1, single_tail=False,
+                 lowest=-36, highest=39, step=5, kinds=('maj', 'm', 'dim'), frames=4, harmonics=4,
+                 detune=10., noise=0.05, note_bins=False, templates=False):
+        self._size = int(size)
+        self._bitrate = bitrate
+        self._threshold = float(threshold)
+        self._note_bins = note_bins
+        self._filter = TemplateFilter if templates else TriadFilter
+        if note_bins:
+            self._engine = NoteBankEngine(self._size, bitrate, db_gain=db_gain)
+        else:
+            self._engine = SpectrumEngine(self._size, bitrate, db_gain=db_gain, single_tail=single_tail)
+        # A1 is 36 semitones below A4, C8 is 39 above
+        self._semitones = range(lowest, highest + 1, step)
+        self._kinds = kinds
+        self._frames = frames
+        self._harmonics = harmonics
+        self._detune = detune
+        self._noise = noise
+
+    def signals(self):
+        # yields (semitone, kind, frames), highest triad note stays at or below C8
+        _seed = 0
+        for semitone in self._semitones:
+            for kind in self._kinds:
+                if semitone + TRIADS[kind][-1] > 39:
+                    continue
+                _frames = []
+                for _ in range(self._frames):
+                    _frames.append(synth_triad(semitone, kind, self._size, self._bitrate, self._harmonics,
+                                               self._detune, self._noise, _seed))
+                    _seed += 1
+                yield semitone, kind, _frames
+
+    def run_chord(self, frames: list, timings=None, allocations=None) -> dict:
+        triad = self._filter(threshold=self._threshold)
+        _update = triad.update_notes if self._note_bins else triad.update
+        chord = {'root': '', 'third': ''}
+        for data in frames:
+            if allocations is not None:
+                reset_peak()
+                _before, _ = get_traced_memory()
+            _start = perf_counter()
+            _x, _y = self._engine.transform(data)
+            _mid = perf_counter()
+            chord = _update(_x, _y)
+            if timings is not None:
+                timings['fft'].append(_mid - _start)
+                timings['filter'].append(perf_counter() - _mid)
+            if allocations is not None:
+                allocations.append(get_traced_memory()[1] - _before)
+        return chord
+
+    def run(self) -> dict:
+        _timings = {'fft': [], 'filter': []}
+        _chords = _roots = _tenses = _tensed = 0
+        _misses = []
+        for semitone, kind, frames in self.signals():
+            chord = self.run_chord(frames, _timings)
+            _root = ROOTS[semitone % 12]
+            _chords += 1
+            if chord['root'] == _root:
+                _roots += 1
+            else:
+                _misses.append('%s%s as %s%s' % (_root, kind, chord['root'], chord['third']))
+            if kind != 'dim' or self._filter is TemplateFilter:
+                # the triad filter only reports major / minor tenses
+                _tensed += 1
+                if chord['root'] == _root and chord['third'].strip() == kind:
+                    _tenses += 1
+        _results = {
+            'size': self._size,
+            'chords': _chords,
+            'frames': len(_timings['fft']),
+            'root_accuracy': _roots / max(_chords, 1),
+            'chord_accuracy': _tenses / max(_tensed, 1)
+        }
+        _total = 0.
+        for stage, values in _timings.items():
+            _ms = [1e3 * v for v in values]
+            _results['%s_ms' % stage] = sum(_ms) / max(len(_ms), 1)
+            _results['%s_p95_ms' % stage] = float(percentile(_ms, 95)) if _ms else 0.
+            _total += sum(values)
+        _results['fps'] = _results['frames'] / _total if _total else 0.
+        _results.update(self.run_allocations())
+        logger.info('suite %(size)d: %(chords)d chords, %(frames)d frames, %(fps).1f fps', _results)
+        logger.info('  fft: %(fft_ms).3f ms (p95 %(fft_p95_ms).3f), filter: %(filter_ms).3f ms (p95 %(filter_p95_ms).3f)',
+                    _results)
+        logger.info('  allocated: %(alloc_frame_kb).1f KiB per frame, peak %(alloc_peak_kb).1f KiB', _results)
+        logger.info('  accuracy: root %(root_accuracy).3f, chord %(chord_accuracy).3f', _results)
+        logger.debug('  misses: %s', _misses)
+        return _results
+
+    def run_gate(self, tolerance=0.05, hold=16) -> dict:
+        # every triad held for `hold` frames, its frames looped, through the filter with and without ChangeGate:
+        #   a steady input must give the same chords either way
+        _frames = _differ = _skipped = _hits = 0
+        _misses = []
+        for semitone, kind, frames in self.signals():
+            triad = self._filter(threshold=self._threshold)
+            gated = ChangeGate(self._filter(threshold=self._threshold), tolerance)
+            _updates = (triad.update_notes, gated.update_notes) if self._note_bins else (triad.update, gated.update)
+            _differs = 0
+            for i in range(hold):
+                _x, _y = self._engine.transform(frames[i % len(frames)])
+                if _updates[0](_x, _y) != _updates[1](_x, _y):
+                    _differs += 1
+            if _differs:
+                _misses.append('%s%s: %d' % (ROOTS[semitone % 12], kind, _differs))
+            _frames += hold
+            _differ += _differs
+            _skipped += gated.skipped
+            _hits += gated.hits
+        _results = {'size': self._size, 'frames': _frames, 'differ': _differ, 'skipped': _skipped, 'hits': _hits}
+        logger.info('gate %(size)d: %(frames)d frames, %(skipped)d skipped, %(hits)d cache hits, %(differ)d differ',
+                    _results)
+        if _misses:
+            logger.warning('  gated chords differ: %s', _misses)
+        return _results
+
+    def run_allocations(self, chords=8) -> dict:
+        # traced separately, tracemalloc overhead would skew the timings
+        _signals = []
+        for signal in self.signals():
+            _signals.append(signal[2])
+            if len(_signals) >= chords:
+                break
+        _tracing = is_tracing()
+        if not _tracing:
+            trace_start()
+        _allocations = []
+        _before, _ = get_traced_memory()
+        for frames in _signals:
+            self.run_chord(frames, allocations=_allocations)
+        _after, _ = get_traced_memory()
+        if not _tracing:
+            trace_stop()
+        # transient is the peak traced memory above the start of each frame
+        return {
+            'alloc_frame_kb': sum(_allocations) / 1024. / max(len(_allocations), 1),
+            'alloc_peak_kb': max(_allocations, default=0) / 1024.,
+            'alloc_retained_kb': (_after - _before) / 1024.
+        }
+
+
+def save_results(path: str, results: dict):
+    with open(path, 'w') as f:
+        dump(results, f, indent=2, sort_keys=True)
+
+
+def compare_results(results: dict, path: str, tolerance=0.05) -> bool:
+    # returns False on a regression of more than `tolerance` in speed or accuracy
+    with open(path) as f:
+        baseline = load(f)
+    _ok = True
+    for key in sorted(set(results) & set(baseline)):
+        _new, _old = results[key], baseline[key]
+        if not isinstance(_new, (int, float)) or not _old:
+            continue
+        _change = (_new - _old) / abs(_old)
+        # lower is better for times and allocations
+        _worse = -_change if key.endswith(('fps', 'accuracy', 'speedup')) else _change
+        if key.endswith(('_ms', '_kb', 'fps', 'accuracy', 'speedup')) and _worse > tolerance:
+            _ok = False
+            logger.warning('regression: %s %.4g -> %.4g (%+.1f%%)', key, _old, _new, 100 * _change)
+        else:
+            logger.info('%s %.4g -> %.4g (%+.1f%%)', key, _old, _new, 100 * _change)
+    return _ok
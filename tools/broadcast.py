@@ -0,0 +1,191 @@
+from asyncio import CancelledError, Queue, QueueFull, all_tasks, current_task, gather, new_event_loop, run_coroutine_threadsafe, \
+    start_server
+from numpy import frombuffer, log10, maximum, ndarray, uint16, zeros
+from socket import create_connection
+from struct import calcsize, pack, unpack_from
+from threading import Event, Thread
+from time import monotonic
+from .log import logger
+
+
+# every message: [u8 kind][u8 channel, 255 for none][u16 payload bytes][f64 seconds since the server started]
+HEADER = '<BBHd'
+HELLO, CHORD, SPECTRUM = 0, 1, 2
+# chord payload: [i8 root index, -1 for none][u8 tense, 0 none, 1 m, 2 maj, 3 dim, 4 aug][u8 LED color]
+CHORD_FORMAT = '<bBB'
+# spectrum payload: [f32 first Hz][f32 last Hz][u8 1 for log spaced bins] then u16 centi-dB per bin
+SPECTRUM_FORMAT = '<ffB'
+VERSION = b'HRM1'
+
+
+def encode(kind: int, payload: bytes, channel=None, time=0.) -> bytes:
+    return pack(HEADER, kind, 255 if channel is None else channel, len(payload), time) + payload
+
+
+def decode(buffer: bytes) -> tuple:
+    # (messages, unconsumed bytes) from a stream buffer, messages as dicts
+    _messages = []
+    _offset = 0
+    _header = calcsize(HEADER)
+    while len(buffer) - _offset >= _header:
+        kind, channel, size, time = unpack_from(HEADER, buffer, _offset)
+        if len(buffer) - _offset - _header < size:
+            break
+        _payload = bytes(buffer[_offset + _header:_offset + _header + size])
+        _offset += _header + size
+        _message = {'kind': kind, 'channel': None if channel == 255 else channel, 'time': time}
+        if kind == HELLO:
+            _message['version'] = _payload
+        elif kind == CHORD:
+            _message['root'], _message['tense'], _message['color'] = unpack_from(CHORD_FORMAT, _payload)
+        elif kind == SPECTRUM:
+            _first, _last, _log = unpack_from(SPECTRUM_FORMAT, _payload)
+            _values = zeros(0, dtype=uint16)
+            if len(_payload) > calcsize(SPECTRUM_FORMAT):
+                _values = frombuffer(_payload, dtype='<u2', offset=calcsize(SPECTRUM_FORMAT))
+            _message.update({'first_hz': _first, 'last_hz': _last, 'log': bool(_log), 'db': _values / 100.})
+        _messages.append(_message)
+    return _messages, buffer[_offset:]
+
+
+def pool_spectrum(y: ndarray, bins: int) -> tuple:
+    # (centi-dB max of every group of bins so peaks survive, input bins used) of at most `bins` values
+    _size = len(y) - len(y) % bins if len(y) > bins else len(y)
+    _pooled = y[:_size].reshape(min(bins, _size), -1).max(axis=1)
+    return (2000. * log10(maximum(_pooled, 1.))).clip(0, 65535).astype('<u2'), _size
+
+
+class BroadcastServer:
+    # asyncio TCP server on its own thread, fanning framed binary messages out to every subscriber:
+    #   each client has a bounded queue, a client whose queue fills up is dropped rather than waited on,
+    #   publishing from the analysis loop never blocks
+    def __init__(self, host='127.0.0.1', port=8765, queue_size=32, spectrum_ms=50., bins=256):
+        self._host = host
+        self._port = int(port)
+        self._queue_size = int(queue_size)
+        self._spectrum = float(spectrum_ms) / 1000. if spectrum_ms else 0.
+        self._bins = int(bins)
+        self._clients = dict()
+        self._last_chord = dict()
+        # newest chord message per channel, so subscribers start from the current state
+        self._chords = dict()
+        self._last_spectrum = dict()
+        self._start = monotonic()
+        self._ready = Event()
+        self._loop = new_event_loop()
+        self._server = None
+        self.sent = 0
+        self.dropped = 0
+        self.connected = 0
+        self._thread = Thread(target=self.run, name='broadcast', daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout=5.)
+        logger.info('broadcasting at: %s:%d', self._host, self._port)
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    def run(self):
+        self._server = self._loop.run_until_complete(start_server(self.serve, self._host, self._port))
+        # port 0 picks a free one
+        self._port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def serve(self, reader, writer):
+        _queue = Queue(maxsize=self._queue_size)
+        self._clients[writer] = _queue
+        self.connected += 1
+        logger.info('subscriber connected: %s', writer.get_extra_info('peername'))
+        try:
+            writer.write(encode(HELLO, VERSION, time=monotonic() - self._start))
+            for message in list(self._chords.values()):
+                writer.write(message)
+            while True:
+                writer.write(await _queue.get())
+                await writer.drain()
+        except (ConnectionError, OSError) as e:
+            logger.debug('subscriber gone: %s', e)
+        except CancelledError:
+            # server closing, ending quietly spares the stream protocol a cancelled task
+            pass
+        finally:
+            self._clients.pop(writer, None)
+            writer.close()
+
+    def fanout(self, message: bytes):
+        # event loop thread
+        for writer, queue in list(self._clients.items()):
+            try:
+                queue.put_nowait(message)
+                self.sent += 1
+            except QueueFull:
+                logger.warning('dropping slow subscriber: %s', writer.get_extra_info('peername'))
+                self.dropped += 1
+                self._clients.pop(writer, None)
+                writer.transport.abort()
+
+    def publish(self, message: bytes):
+        if self._clients:
+            self._loop.call_soon_threadsafe(self.fanout, message)
+
+    def chord(self, index: int, tense: int, color=0, channel=None):
+        # published on changes only, per channel
+        if self._last_chord.get(channel) == (index, tense):
+            return
+        self._last_chord[channel] = (index, tense)
+        _message = encode(CHORD, pack(CHORD_FORMAT, index, tense, color), channel, monotonic() - self._start)
+        self._chords[channel] = _message
+        self.publish(_message)
+
+    def spectrum(self, x: ndarray, y: ndarray, channel=None):
+        _now = monotonic()
+        if not self._spectrum or not self._clients or _now - self._last_spectrum.get(channel, 0.) < self._spectrum:
+            return
+        self._last_spectrum[channel] = _now
+        _values, _size = pool_spectrum(y, self._bins)
+        if not _size:
+            return
+        _log = int(_size > 2 and x[1] - x[0] < 0.99 * (x[_size - 1] - x[_size - 2]))
+        _payload = pack(SPECTRUM_FORMAT, float(x[0]), float(x[_size - 1]), _log) + _values.tobytes()
+        self.publish(encode(SPECTRUM, _payload, channel, _now - self._start))
+
+    def stats(self) -> dict:
+        return {'clients': len(self._clients), 'connected': self.connected, 'sent': self.sent,
+                'dropped': self.dropped}
+
+    async def shutdown(self):
+        self._server.close()
+        for writer in list(self._clients):
+            writer.transport.abort()
+        _tasks = [task for task in all_tasks() if task is not current_task()]
+        for task in _tasks:
+            task.cancel()
+        await gather(*_tasks, return_exceptions=True)
+
+    def close(self):
+        run_coroutine_threadsafe(self.shutdown(), self._loop).result(timeout=2.)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=2.)
+        self._loop.close()
+        logger.info('broadcast sent: %(sent)d, subscribers: %(connected)d, dropped: %(dropped)d', self.stats())
+
+
+class BroadcastClient:
+    # blocking subscriber, for dashboards and loopback tests
+    def __init__(self, host='127.0.0.1', port=8765, timeout=5.):
+        self._socket = create_connection((host, port), timeout=timeout)
+        self._buffer = b''
+        self._messages = []
+
+    def read(self) -> dict:
+        while not self._messages:
+            _data = self._socket.recv(65536)
+            if not _data:
+                raise ConnectionError('broadcast server closed')
+            self._messages, self._buffer = decode(self._buffer + _data)
+        return self._messages.pop(0)
+
+    def close(self):
+        self._socket.close()
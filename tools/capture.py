@@ -1,76 +1,462 @@
-from numpy import add, arange, average, abs, empty, fromstring, fft, int16, log10, multiply, ndarray, reshape, split
-from pyaudio import PyAudio, paInt16
-from threading import Thread
+from numpy import add, arange, average, abs, bartlett, blackman, ceil, complex128, concatenate, conj, cumsum, empty, \
+    exp, exp2, float64, flatnonzero, frombuffer, fft, hamming, hanning, int16, log10, minimum, multiply, ndarray, \
+    ones, pi, repeat, reshape, split, zeros
+from threading import Event, Thread
+from time import perf_counter, sleep
 from .log import logger
+from .metrics import metrics
+from .ring import RingBuffer
+
+
+class SpectrumEngine:
+    _windows = {
+        'rect': ones,
+        'hann': hanning,
+        'hamming': hamming,
+        'blackman': blackman,
+        'bartlett': bartlett
+    }
+
+    # planned once per (size, window, scale) configuration, then reused every frame
+    def __init__(self, size: int, bitrate: int, window='rect', slice=10, log_scale=False, db_gain=1e-2,
+                 single_tail=False):
+        self._size = int(size)
+        self._bitrate = bitrate
+        self._window_name = window
+        self._log_scale = log_scale
+        self._db_gain = float(db_gain) if db_gain else 0.
+        self._single_tail = bool(single_tail)
+        _span = self._size // 2 if self._single_tail else self._size
+        self._bins = int(_span / slice) if slice else _span
+        self._rbins = self._size // 2 + 1
+        self._window = None
+        if window not in (None, 'rect'):
+            self._window = self._windows[window](self._size)
+        # |X[N - k]| == |X[k]| for real input, so bins past nyquist are mirrored
+        self._mirror = None
+        if not self._single_tail and self._bins > self._rbins:
+            _k = arange(self._bins)
+            self._mirror = minimum(_k, self._size - _k)
+        self._x = arange(self._bins, dtype=float64) * float(self._bitrate / self._size)
+        self._frame = empty(self._size, dtype=float64)
+        self._spectrum = empty(self._rbins, dtype=complex128)
+        self._magnitude = empty(self._rbins, dtype=float64)
+        self._y = empty(self._bins, dtype=float64)
+
+    @staticmethod
+    def key(size: int, window='rect', slice=10, log_scale=False, db_gain=1e-2, single_tail=False) -> tuple:
+        return int(size), window, slice, bool(log_scale), float(db_gain) if db_gain else 0., bool(single_tail)
+
+    def frequencies(self) -> ndarray:
+        return self._x
+
+    def transform(self, data: ndarray, out=None) -> tuple:
+        if out is None:
+            out = self._y
+        if self._window is not None:
+            multiply(data, self._window, out=self._frame)
+        else:
+            self._frame[:] = data
+        try:
+            fft.rfft(self._frame, out=self._spectrum)
+        except TypeError:
+            # numpy < 2.0 has no `out` on the transforms
+            self._spectrum[:] = fft.rfft(self._frame)
+        abs(self._spectrum, out=self._magnitude)
+        if self._single_tail:
+            # same folding as `split`/`add` of the full transform: |X[k]| + |X[N - 1 - k]|
+            add(self._magnitude[:self._bins], self._magnitude[1:self._bins + 1], out=out)
+        elif self._mirror is not None:
+            self._magnitude.take(self._mirror, out=out)
+        else:
+            out[:] = self._magnitude[:self._bins]
+        if self._log_scale:
+            log10(out, out=out)
+            multiply(20, out, out=out)
+        if self._db_gain:
+            multiply(self._db_gain, out, out=out)
+        return self._x, out
+
+    def transform_frames(self, frames: ndarray, out=None) -> tuple:
+        # batched STFT: one (frames, size) array in, one (frames, bins) magnitude array out
+        _count = frames.shape[0]
+        if out is None:
+            out = empty((_count, self._bins), dtype=float64)
+        if self._window is not None:
+            _frames = multiply(frames, self._window)
+        else:
+            _frames = frames.astype(float64)
+        _magnitude = abs(fft.rfft(_frames, axis=-1))
+        if self._single_tail:
+            add(_magnitude[:, :self._bins], _magnitude[:, 1:self._bins + 1], out=out)
+        elif self._mirror is not None:
+            _magnitude.take(self._mirror, axis=-1, out=out)
+        else:
+            out[:] = _magnitude[:, :self._bins]
+        if self._log_scale:
+            log10(out, out=out)
+            multiply(20, out, out=out)
+        if self._db_gain:
+            multiply(self._db_gain, out, out=out)
+        return self._x, out
+
+
+class NoteBankEngine:
+    # constant-Q filterbank with one bin per semitone, `lowest` and `highest` count from A4 (A1 is -36, C8 is 39)
+    #   spectral kernels after Brown & Puckette, thresholded to a band of bins around each note
+    #   and kept as a sparse row matrix, applied to the real-input transform with one gather, multiply and row sum
+    def __init__(self, size: int, bitrate: int, lowest=-36, highest=39, db_gain=1e-2, sparsity=0.0054,
+                 reference=440.0):
+        self._size = int(size)
+        self._bitrate = bitrate
+        self._db_gain = float(db_gain) if db_gain else 0.
+        self._semitones = arange(lowest, highest + 1)
+        self._x = reference * exp2(self._semitones / 12.)
+        self._rbins = self._size // 2 + 1
+        _q = 1. / (exp2(1. / 12.) - 1.)
+        _index = []
+        _weights = []
+        for f in self._x:
+            # low notes want longer kernels than the frame, they lose Q instead
+            _length = min(self._size, int(ceil(_q * bitrate / f)))
+            _start = (self._size - _length) // 2
+            _temporal = zeros(self._size, dtype=complex128)
+            _temporal[_start:_start + _length] = hanning(_length) / _length * \
+                exp(2j * pi * f * arange(_length) / bitrate)
+            _kernel = conj(fft.fft(_temporal)[:self._rbins]) / self._size
+            _keep = flatnonzero(abs(_kernel) >= sparsity * abs(_kernel).max())
+            _band = arange(_keep[0], _keep[-1] + 1)
+            _index.append(_band)
+            _weights.append(_kernel[_band])
+        # rows are contiguous runs in the flat arrays, `_rows` holds where each note starts
+        self._rows = cumsum([0] + [len(band) for band in _index[:-1]])
+        self._index = concatenate(_index)
+        self._weights = concatenate(_weights)
+        # a sine of amplitude A reads A * size / 2 like the plain transform, so thresholds carry over
+        self._scale = 2. * self._size * (self._db_gain or 1.)
+        self._frame = empty(self._size, dtype=float64)
+        self._spectrum = empty(self._rbins, dtype=complex128)
+        self._gather = empty(len(self._index), dtype=complex128)
+        self._notes = empty(len(self._x), dtype=complex128)
+        self._y = empty(len(self._x), dtype=float64)
+        logger.debug('note bank: %d notes, kernel: %d of %d weights', len(self._x), len(self._index),
+                     len(self._x) * self._rbins)
+
+    @staticmethod
+    def key(size: int, lowest=-36, highest=39, db_gain=1e-2) -> tuple:
+        return 'notes', int(size), int(lowest), int(highest), float(db_gain) if db_gain else 0.
+
+    def frequencies(self) -> ndarray:
+        return self._x
+
+    def semitones(self) -> ndarray:
+        return self._semitones
+
+    def transform(self, data: ndarray, out=None) -> tuple:
+        if out is None:
+            out = self._y
+        self._frame[:] = data
+        try:
+            fft.rfft(self._frame, out=self._spectrum)
+        except TypeError:
+            self._spectrum[:] = fft.rfft(self._frame)
+        self._spectrum.take(self._index, out=self._gather)
+        multiply(self._gather, self._weights, out=self._gather)
+        add.reduceat(self._gather, self._rows, out=self._notes)
+        abs(self._notes, out=out)
+        multiply(self._scale, out, out=out)
+        return self._x, out
+
+    def transform_frames(self, frames: ndarray, out=None) -> tuple:
+        if out is None:
+            out = empty((frames.shape[0], len(self._x)), dtype=float64)
+        _spectra = fft.rfft(frames.astype(float64), axis=-1)
+        abs(add.reduceat(_spectra[:, self._index] * self._weights, self._rows, axis=-1), out=out)
+        multiply(self._scale, out, out=out)
+        return self._x, out
+
+
+class FakeStream:
+    # stands in for a PyAudio input stream, loops over interleaved `source` samples at the stream rate
+    #   blocking reads, or a thread feeding `stream_callback` one buffer at a time
+    def __init__(self, source: ndarray, rate=48100, channels=1, frames_per_buffer=1024, stream_callback=None,
+                 realtime=True, **kwargs):
+        # a mono source is heard on every channel
+        self._source = repeat(source, channels) if channels > 1 else source
+        self._rate = rate
+        self._channels = channels
+        self._frames = frames_per_buffer
+        self._callback = stream_callback
+        self._realtime = realtime
+        self._position = 0
+        self._stopped = Event()
+        self._thread = None
+        if self._callback is not None:
+            self._thread = Thread(target=self.run, name='fake-stream', daemon=True)
+            self._thread.start()
+
+    def next_buffer(self, frames: int) -> bytes:
+        _size = frames * self._channels
+        _data = self._source.take(range(self._position, self._position + _size), mode='wrap')
+        self._position = (self._position + _size) % len(self._source)
+        return _data.tobytes()
+
+    def read(self, frames: int, exception_on_overflow=True) -> bytes:
+        if self._realtime:
+            sleep(float(frames) / self._rate)
+        return self.next_buffer(frames)
+
+    def run(self):
+        _period = float(self._frames) / self._rate
+        _next = perf_counter()
+        while not self._stopped.is_set():
+            _, flag = self._callback(self.next_buffer(self._frames), self._frames, {}, 0)
+            if flag:
+                break
+            if self._realtime:
+                _next += _period
+                self._stopped.wait(max(0., _next - perf_counter()))
+
+    def is_active(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop_stream(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.)
+
+    def close(self):
+        self.stop_stream()
+
+
+class FakeAudio:
+    # stands in for the pyaudio module and its PyAudio session, streams serve `source` on a loop
+    paInt16 = 8
+    paContinue = 0
+
+    def __init__(self, source=None, realtime=True):
+        self._source = zeros(48100, dtype=int16) if source is None else source
+        self._realtime = realtime
+
+    def PyAudio(self) -> 'FakeAudio':
+        return self
+
+    def open(self, **kwargs) -> FakeStream:
+        return FakeStream(self._source, realtime=self._realtime, **kwargs)
+
+    def close(self, stream: FakeStream):
+        stream.close()
+
+    def terminate(self):
+        pass
 
 
 class AudioCapture:
-    def __init__(self):
-        self._bitrate = 48100
-        self._buffer_size = 8192
+    def __init__(self, window_size=None, hop_size=None, latest=True, ring=None, channels=1, devices=None,
+                 callback=False, backend=None, bitrate=48100, buffer_size=8192, recorder=None, resolutions=None):
+        self._bitrate = int(bitrate)
+        self._buffer_size = int(buffer_size)
         self._sec_to_capture = 0.1
         self._exiting = False
         self._running = False
-        self.has_captured = False
+        self._audio_signal = None
+        self._input_stream = None
+        self._input_streams = []
+        # set by a failed read, every stream is reopened once the block is complete
+        self._read_failed = False
+        # `channels` per device, `devices` are PyAudio input device indexes, None is the default input
+        self._channels = int(channels)
+        self._devices = list(devices) if devices else [None]
+        self._inputs = self._channels * len(self._devices)
+        # callback mode: PyAudio hands buffers to `on_audio`, which views them in place and copies once into the ring
+        self._callback = callback
+        if self._callback and len(self._devices) > 1:
+            raise ValueError('callback capture supports a single device, got: %s' % self._devices)
+        # the pyaudio module, or a stand-in such as FakeAudio
+        self._backend = backend
+        self._continue = 0
+        # keeps every captured block, see tools.replay.StreamRecorder
+        self._recorder = recorder
+        self._engines = dict()
+        self._y_batch = dict()
+        # perf_counter when the newest block landed in the ring, and when the last read frame ended
+        self._captured_at = 0.
+        self.frame_time = 0.
         logger.info('AudioCapture settings:')
         self._capture_buffers = int(self._sec_to_capture * self._bitrate / self._buffer_size)
         if not self._capture_buffers:
             self._capture_buffers = 1
         self._capture_samples = int(self._buffer_size * self._capture_buffers) # == sec_to_capture * bitrate
         self._sec_per_period = 1.0 / self._bitrate
-        self.open_input_stream()
         self._x_buffer = arange(self._buffer_size) * self._sec_per_period
         self._x_values = arange(self._capture_buffers * self._buffer_size) * self._sec_per_period
-        self._x_audio = empty((self._capture_buffers * self._buffer_size), dtype=int16)
+        # sliding analysis frames: `window_size` samples every `hop_size` samples
+        self._window_size = int(window_size or self._capture_samples)
+        self._hop_size = int(hop_size or self._window_size)
+        self._latest = latest
+        # multi-resolution: shorter windows analyzed over the newest samples of every frame, see `bands`
+        self._resolutions = tuple(sorted({int(size) for size in resolutions or ()}, reverse=True))
+        if any(size >= self._window_size for size in self._resolutions):
+            raise ValueError('resolutions must be shorter than the %d sample window, got: %s' %
+                             (self._window_size, list(self._resolutions)))
+        _ring_size = 4 * max(self._window_size, self._hop_size, self._buffer_size)
+        if self._inputs > 1:
+            # samples are deinterleaved into (inputs, samples) and spectra batched across inputs
+            self._ring = ring if ring is not None else RingBuffer(_ring_size, channels=self._inputs,
+                                                                  max_block=self._buffer_size)
+            self._x_audio = empty((self._inputs, self._window_size), dtype=int16)
+            self._x_block = empty((self._inputs, self._buffer_size), dtype=int16)
+        else:
+            self._ring = ring if ring is not None else RingBuffer(_ring_size, max_block=self._buffer_size)
+            self._x_audio = empty(self._window_size, dtype=int16)
+        # returned when a read fails, instead of building zeros per error
+        self._silence = zeros(self._buffer_size * self._channels, dtype=int16)
         self._capture_thread = Thread(target=self.record)
         logger.info('  bitrate: %d, buffer_size: %d', self._bitrate, self._buffer_size)
         logger.info('  capture_buffers: %d, capture_samples: %d, sec_per_period: %g',
                     self._capture_buffers, self._capture_samples, self._sec_per_period)
+        logger.info('  window_size: %d, hop_size: %d, ring_size: %d, resolutions: %s',
+                    self._window_size, self._hop_size, self._ring.capacity, list(self._resolutions))
+        logger.info('  devices: %s, channels: %d, inputs: %d, callback: %s',
+                    self._devices, self._channels, self._inputs, self._callback)
+
+    @property
+    def inputs(self) -> int:
+        return self._inputs
+
+    @property
+    def bitrate(self) -> int:
+        return self._bitrate
+
+    @property
+    def window_size(self) -> int:
+        return self._window_size
+
+    @property
+    def has_captured(self) -> bool:
+        return self._ring.frame_ready(self._window_size)
+
+    @property
+    def finished(self) -> bool:
+        # live capture never runs out, replayed recordings do
+        return False
+
+    def frame_stats(self) -> dict:
+        return self._ring.stats()
+
+    def read_frame(self, out=None) -> (ndarray or None):
+        if out is None:
+            out = self._x_audio
+        _captured_at = self._captured_at
+        if self._ring.read_frame(out, self._hop_size, latest=self._latest):
+            self.frame_time = _captured_at
+            return out
+        return None
 
     def open_input_stream(self, purge=False):
-        if purge:
-            self._audio_signal.close(self._input_stream)
+        _backend = self._backend
+        if _backend is None:
+            # imported on first use so analysis works without the audio stack installed
+            import pyaudio as _backend
+        if purge and self._audio_signal is not None:
+            for stream in self._input_streams:
+                self._audio_signal.close(stream)
             self._audio_signal.terminate()
             del self._audio_signal
-        self._audio_signal = PyAudio()
-        self._input_stream = self._audio_signal.open(
-            format=paInt16,
-            channels=1,
-            rate=self._bitrate,
-            input=True,
-            frames_per_buffer=self._buffer_size
-        )
+        self._continue = _backend.paContinue
+        self._audio_signal = _backend.PyAudio()
+        self._input_streams = [
+            self._audio_signal.open(
+                format=_backend.paInt16,
+                channels=self._channels,
+                rate=self._bitrate,
+                input=True,
+                frames_per_buffer=self._buffer_size,
+                input_device_index=device,
+                stream_callback=self.on_audio if self._callback else None
+            ) for device in self._devices
+        ]
+        self._input_stream = self._input_streams[0]
 
     def close(self):
         if self._running:
             self.stop()
             self._capture_thread.join()
-        # self._audio_signal.close(self._input_stream)
-        self._audio_signal.terminate()
+        if self._callback:
+            for stream in self._input_streams:
+                stream.stop_stream()
+        logger.info('frames: %(frames)d, dropped: %(dropped)d, overruns: %(overruns)d', self.frame_stats())
+        if self._recorder is not None:
+            self._recorder.close()
+        if self._audio_signal is not None:
+            # self._audio_signal.close(self._input_stream)
+            self._audio_signal.terminate()
 
-    def get_audio(self) -> ndarray:
+    def read_stream(self, stream) -> ndarray:
+        _start = perf_counter()
         try:
-            str_audio = self._input_stream.read(self._buffer_size)
+            # a read-only view of the bytes, the ring write is the only copy
+            _samples = frombuffer(stream.read(self._buffer_size), dtype=int16)
+            metrics.since('capture', _start)
         except IOError as e:
             logger.error('audio err: %s, %s', e, e.errno)
+            self._read_failed = True
+            _samples = self._silence
+        return _samples
+
+    def reopen(self):
+        if self._read_failed:
+            self._read_failed = False
+            metrics.count('reopen')
             self.open_input_stream(purge=True)
-            str_audio = '\x00' * 2 * self._buffer_size
-        return fromstring(str_audio, dtype=int16)
+
+    def on_audio(self, in_data: bytes, frame_count: int, time_info: dict, status: int) -> tuple:
+        # PyAudio callback thread: no allocation beyond the view, samples go straight into the ring
+        _start = perf_counter()
+        if status:
+            metrics.count('input_status')
+        _samples = frombuffer(in_data, dtype=int16)
+        if self._inputs > 1:
+            # deinterleaved by a transposed view, the ring copies it into place
+            _samples = _samples.reshape(frame_count, self._channels).T
+        self.push(_samples)
+        metrics.since('callback', _start)
+        return None, self._continue
+
+    def get_audio(self) -> ndarray:
+        if self._inputs == 1:
+            _samples = self.read_stream(self._input_stream)
+            self.reopen()
+            return _samples
+        # every device is read from the streams the block started with, a failed one leaves silence until the
+        #   single reopen after the loop
+        for i, stream in enumerate(self._input_streams):
+            _samples = self.read_stream(stream).reshape(self._buffer_size, self._channels)
+            # deinterleave into the preallocated block
+            self._x_block[i * self._channels:(i + 1) * self._channels] = _samples.T
+        self.reopen()
+        return self._x_block
+
+    def push(self, block: ndarray):
+        self._ring.write(block)
+        self._captured_at = perf_counter()
+        if self._recorder is not None:
+            self._recorder.write(block)
 
     def record(self, forever=True):
         while not self._exiting:
             self._running = True
             for i in range(self._capture_buffers):
-                _lower = int(i * self._buffer_size)
-                _upper = int((i + 1) * self._buffer_size)
-                self._x_audio[_lower:_upper] = self.get_audio()
-            self.has_captured = True
+                self.push(self.get_audio())
             if not forever:
                 break
         self._running = False
 
     def start(self):
-        self._capture_thread.start()
+        if self._input_stream is None:
+            self.open_input_stream()
+        if not self._callback:
+            self._capture_thread.start()
 
     def stop(self):
         self._exiting = True
@@ -79,17 +465,80 @@ class AudioCapture:
         window_overlap = len(data) % scale
         if window_overlap:
             data = data[:-window_overlap]
-        data = reshape(data, (len(data) / scale, scale))
+        data = reshape(data, (len(data) // scale, scale))
         data = average(data, 1)
         return data
 
-    def fft(self, data=None, slice=10, log_scale=False, db_gain=1e-2, single_tail=False) -> tuple:
+    def get_engine(self, size: int, window='rect', slice=10, log_scale=False, db_gain=1e-2,
+                   single_tail=False) -> SpectrumEngine:
+        _key = SpectrumEngine.key(size, window, slice, log_scale, db_gain, single_tail)
+        if _key not in self._engines:
+            logger.debug('planning spectrum: %s', _key)
+            self._engines[_key] = SpectrumEngine(size, self._bitrate, window, slice, log_scale, db_gain,
+                                                 single_tail)
+        return self._engines[_key]
+
+    def fft(self, data=None, slice=10, log_scale=False, db_gain=1e-2, single_tail=False, window='rect',
+            out=None) -> (tuple or None):
+        # without data a frame is read from the ring, None when none is ready or it tore
+        if data is None:
+            data = self.read_frame()
+            if data is None:
+                return None
+        _engine = self.get_engine(data.shape[-1], window, slice, log_scale, db_gain, single_tail)
+        return self.transform(_engine, data, out)
+
+    def bands(self, data=None, slice=10, db_gain=1e-2, single_tail=False, window='rect') -> (list or None):
+        # (x, y) per window, longest first: one frame read from the ring, the shorter windows are views of
+        #   its newest samples, and their magnitudes are scaled by the window ratio so one threshold holds for all
+        if data is None:
+            data = self.read_frame()
+            if data is None:
+                return None
+        _size = data.shape[-1]
+        _bands = []
+        for size in (_size,) + self._resolutions:
+            _engine = self.get_engine(size, window, slice, False, float(db_gain or 1.) * _size / size, single_tail)
+            _bands.append(self.transform(_engine, data[..., _size - size:]))
+        return _bands
+
+    def notes(self, data=None, db_gain=1e-2, lowest=-36, highest=39, out=None) -> (tuple or None):
+        # per-semitone magnitudes from A1 to C8 instead of linear bins
+        if data is None:
+            data = self.read_frame()
+            if data is None:
+                return None
+        _key = NoteBankEngine.key(data.shape[-1], lowest, highest, db_gain)
+        if _key not in self._engines:
+            logger.debug('planning note bank: %s', _key)
+            self._engines[_key] = NoteBankEngine(data.shape[-1], self._bitrate, lowest, highest, db_gain)
+        return self.transform(self._engines[_key], data, out)
+
+    def transform(self, engine, data: ndarray, out=None) -> tuple:
+        _start = perf_counter()
+        if data.ndim > 1:
+            # one batched transform for every input
+            if out is None:
+                out = self._y_batch.get(engine)
+                if out is None or out.shape[0] != data.shape[0]:
+                    out = empty((data.shape[0], len(engine.frequencies())), dtype=float64)
+                    self._y_batch[engine] = out
+            _spectrum = engine.transform_frames(data, out=out)
+        else:
+            _spectrum = engine.transform(data, out=out)
+        metrics.since('spectrum', _start)
+        return _spectrum
+
+    def complex_fft(self, data=None, slice=10, log_scale=False, db_gain=1e-2, single_tail=False) -> (tuple or None):
+        # reference full complex transform, kept for benchmarking against `fft`
         if data is None:
-            data = self._x_audio.flatten()
-        self.has_captured = False
-        _buffer_size = self._buffer_size
+            data = self.read_frame()
+            if data is None:
+                return None
+        _frame_size = len(data)
+        _buffer_size = _frame_size
         if single_tail:
-            _buffer_size = float(self._buffer_size / 2)
+            _buffer_size = float(_frame_size / 2)
             lhs, rhs = split( abs( fft.fft(data) ), 2)
             _y = add(lhs, rhs[::-1])
         else:
@@ -100,7 +549,7 @@ class AudioCapture:
         if slice:
             i = int(_buffer_size / slice)
             _y = _y[:i]
-            _x = _x[:i] * float(self._bitrate / self._buffer_size)
+            _x = _x[:i] * float(self._bitrate / _frame_size)
         if db_gain:
             _y = float(db_gain) * _y
         return _x, _y
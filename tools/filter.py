@@ -1,6 +1,17 @@
-from numpy import arange, empty, greater, ndarray, sin, pi
-from scipy.signal import argrelextrema
+from numpy import abs, arange, argmax, argmin, argpartition, asarray, bincount, concatenate, empty, exp2, eye, \
+    flatnonzero, float64, full, greater, log2, maximum, ndarray, rint, roll, sin, pi, stack, zeros
+from time import perf_counter
 from .log import logger
+from .metrics import metrics
+
+
+def map_notes(frequencies: ndarray, reference=440.0) -> tuple:
+    # one pass over all peaks: (note index from A, octave from A4, cents error) arrays
+    _semitones = 12. * log2(asarray(frequencies, dtype=float64) / reference)
+    _nearest = rint(_semitones)
+    _cents = 100. * (_semitones - _nearest)
+    _n = _nearest.astype(int)
+    return _n % 12, _n // 12, _cents
 
 
 class NoteLabel:
@@ -17,17 +28,30 @@ class NoteLabel:
 
 
 class TriadFilter:
-    def __init__(self, x, y, verbose=False, threshold=2e+4):
+    # the per-frame chord also depends on the notes held from earlier frames, so it cannot be gated, see ChangeGate
+    chroma_only = False
+
+    def __init__(self, x=None, y=None, verbose=False, threshold=2e+4, decay=0.8, peaks=None, interpolate=False):
         self._verbose = verbose
         self._magnitude = threshold
-        self._threshold = empty(y.size)
-        self._threshold.fill(self._magnitude)
-        self._maxima = argrelextrema(y, greater)
-        for i in self._maxima:
-            self._y = y[i]
-            self._x = x[i]
-        self._yy = []
-        self._xx = []
+        # at most `peaks` strongest maxima per frame, placed between bins by parabolic interpolation if `interpolate`
+        # (off by default, mixed accuracy on the synthetic benchmark)
+        self._peaks = int(peaks) if peaks else 0
+        self._interpolate = interpolate
+        # running state decays by `decay` per frame, modes under `_mode_floor` count as unseen
+        self._decay = float(decay)
+        self._mode_floor = 0.1
+        self._size = 0
+        self._step = 0.
+        # (x, index, octave, error, gain) per bin of a note-bin spectrum, None for linear spectra
+        self._bank = None
+        # (bin, note) map folding a spectrum onto 12 notes, see plan_chroma
+        self._chroma_x = None
+        self._chroma_map = None
+        # multi-resolution frames: bin steps, (lower, upper) Hz and chroma maps per window, see plan_bands
+        self._band_steps = ()
+        self._band_limits = []
+        self._band_maps = []
         # center filter on A1 to C8 within A4 to A5 window
         self._octave_lower = -4
         self._octave_upper = 3
@@ -69,19 +93,125 @@ class TriadFilter:
         self._dominant_4th = 5
         self._dominant_dim = 6
         self._dominant_5th = 7
-        # note tracking
-        self._note_set = list()
-        self._note_modes = [0 for _ in self._roots]
-        self._note_labels = list()
-        self._minmax_freq = None
-        self._step = x[1]
+        self._sound = [' m', ' maj']
+        # 12x12 shift matrices, (shift @ chroma)[n] is the chroma of the note `interval` below n:
+        #   minor 3rd, major 3rd, 4th, diminished 5th, 5th
+        self._intervals = [self._minor_3rd, self._major_3rd, self._dominant_4th, self._dominant_dim,
+                           self._dominant_5th]
+        self._shifts = stack([roll(eye(len(self._roots)), interval, axis=0) for interval in self._intervals])
         self._w1 = float(2 * self._freqs[len(self._freqs)-1] * self._octave_upper)
-        self._i1 = int(self._w1 / self._step)
-        self._profile_ticks = arange(0, x[len(x)-1] + self._step, self._step)
-        self._profile_g_win = self._threshold * sin(pi * self._profile_ticks / self._w1)
         # audio weights       [   -4,    -3,    -2,    -1,      0,     1,      2,     3]
         self._profile_gains = [1.000, 1.000, 1.000,  1.000, 1.000, 1.000,  1.000, 1.000]
-        self._profile_distr = [0. for _ in range(len(self._profile_gains))]
+        # running state across frames
+        self._note_modes = zeros(len(self._roots))
+        self._chord_scores = zeros((len(self._roots), len(self._sound) + 1))
+        self.reset()
+        if x is not None and y is not None:
+            self.plan(x, y.size)
+            self.load(x, y)
+
+    def plan(self, x: ndarray, size: int):
+        # geometry dependent arrays, rebuilt only when the FFT size or resolution changes
+        if self._bank is None and size == self._size and x[1] == self._step:
+            return
+        logger.debug('planning triad filter: %d bins of %.3f', size, x[1])
+        self._bank = None
+        self._size = size
+        self._step = x[1]
+        self._threshold = empty(size)
+        self._threshold.fill(self._magnitude)
+        self._i1 = int(self._w1 / self._step)
+        self._profile_ticks = arange(size) * self._step
+        self._profile_g_win = self._threshold * sin(pi * self._profile_ticks / self._w1)
+
+    def plan_notes(self, x: ndarray):
+        # note-bin spectra: every bin already is a note, so notes are mapped once per bank instead of per peak
+        if self._bank is not None and self._bank[0] is x:
+            return
+        logger.debug('planning triad filter: %d note bins', x.size)
+        _index, _octave, _ = map_notes(x, self._freqs[0])
+        # a note bin is only known to half a semitone
+        _error = x * (exp2(1. / 24.) - 1.)
+        _gain = self._magnitude * sin(pi * x / self._w1)
+        self._bank = (x, _index, _octave, _error, _gain)
+        self._size = 0
+        self._threshold = empty(x.size)
+        self._threshold.fill(self._magnitude)
+        self._profile_ticks = x
+        self._profile_g_win = _gain
+
+    def plan_chroma(self, x: ndarray):
+        # (bin, note) map of the spectrum bins inside the filter range, rebuilt when the frequency axis changes
+        if self._chroma_x is x:
+            return
+        logger.debug('planning chroma map: %d bins', x.size)
+        _index, _, _ = map_notes(maximum(x, 1e-9), self._freqs[0])
+        _inside = (x >= self._lower_filter_limit) & (x <= self._upper_filter_limit)
+        self._chroma_map = zeros((x.size, len(self._roots)))
+        self._chroma_map[arange(x.size)[_inside], _index[_inside]] = 1.
+        self._chroma_x = x
+
+    def chroma(self, y: ndarray) -> ndarray:
+        # magnitude above the threshold folded onto 12 notes, rows for a (frames, bins) batch
+        return maximum(y - self._magnitude, 0.) @ self._chroma_map
+
+    def plan_bands(self, bands: list):
+        # (x, y) per window of a multi-resolution frame, longest window first:
+        #   every octave goes to the shortest window with a bin per semitone at its lowest note,
+        #   the lowest octaves to the longest window whatever its resolution
+        x, y = bands[0]
+        self.plan(x, y.size)
+        _steps = tuple(float(x[1]) for x, _ in bands)
+        if _steps == self._band_steps:
+            return
+        _octaves = range(self._octave_lower, self._octave_upper + 1)
+        # octaves start halfway between G♯|A♭ and A, as map_notes rounds
+        _starts = [self._freqs[0] * 2. ** (octave - 1. / 24.) for octave in _octaves]
+        _owners = [max([0] + [i for i, step in enumerate(_steps) if step <= start * (exp2(1. / 12.) - 1.)])
+                   for start in _starts]
+        self._band_limits = []
+        for i in range(len(bands)):
+            _owned = [j for j, owner in enumerate(_owners) if owner == i]
+            if not _owned:
+                self._band_limits.append((0., 0.))
+                continue
+            _upper = _starts[_owned[-1] + 1] if _owned[-1] + 1 < len(_starts) else self._upper_filter_limit
+            self._band_limits.append((max(_starts[_owned[0]], self._lower_filter_limit),
+                                      min(_upper, self._upper_filter_limit)))
+        self._band_maps = []
+        for (x, _), (lower, upper) in zip(bands, self._band_limits):
+            _index, _, _ = map_notes(maximum(x, 1e-9), self._freqs[0])
+            _inside = (x >= lower) & (x < upper)
+            _map = zeros((x.size, len(self._roots)))
+            _map[arange(x.size)[_inside], _index[_inside]] = 1.
+            self._band_maps.append(_map)
+        self._band_steps = _steps
+        logger.debug('planning triad filter bands: %s', ['%.3f Hz bins: %.1f to %.1f Hz' % (step, lower, upper)
+                                                         for step, (lower, upper) in zip(_steps, self._band_limits)])
+
+    def band_chroma(self, bands: list) -> ndarray:
+        # chroma of a multi-resolution frame, each window folding only its own band
+        return sum(maximum(y - self._magnitude, 0.) @ _map for (_, y), _map in zip(bands, self._band_maps))
+
+    def reset(self):
+        # per-frame state
+        self._maxima = empty(0, dtype=int)
+        self._gain = empty(0)
+        self._floor = 0.
+        self._x = empty(0)
+        self._y = empty(0)
+        self._yy = empty(0)
+        self._xx = empty(0)
+        # note tracking
+        self._note_set = list()
+        self._note_index = empty(0, dtype=int)
+        self._note_octave = empty(0, dtype=int)
+        self._note_cents = empty(0)
+        self._note_error = empty(0)
+        self._note_gain = empty(0)
+        self._note_input = empty(0)
+        self._minmax_freq = -1
+        self._profile_distr = zeros(len(self._profile_gains))
         # interval tracking
         self._third = [-1, -1]
         self._dominant = [-1, -1, -1]
@@ -96,7 +226,120 @@ class TriadFilter:
         self._index = -1
         self._tonic = ''
         self._tense = ''
-        self._sound = [' m', ' maj']
+
+    def load(self, x: ndarray, y: ndarray, lower=None, upper=None):
+        # one pass: strict interior local maxima (as scipy.signal.argrelextrema(y, greater)) above the threshold
+        #   and inside the filter range, or [lower, upper) Hz, then the strongest `_peaks` of those
+        _inner = y[1:-1]
+        _x = x[1:-1]
+        if lower is None:
+            _inside = (_x >= self._lower_filter_limit) & (_x <= self._upper_filter_limit)
+        else:
+            _inside = (_x >= lower) & (_x < upper)
+        _maxima = flatnonzero(greater(_inner, y[:-2]) & greater(_inner, y[2:]) & greater(_inner, self._magnitude) &
+                              _inside) + 1
+        if self._peaks and _maxima.size > self._peaks:
+            _maxima = _maxima[argpartition(y[_maxima], -self._peaks)[-self._peaks:]]
+            _maxima.sort()
+        self._maxima = _maxima
+        self._y = y[_maxima]
+        self._x = x[_maxima]
+        # profile gain per peak, and the least hz error an interpolated peak is trusted to
+        self._gain = self._profile_g_win[_maxima] if lower is None else self._magnitude * sin(pi * self._x / self._w1)
+        self._floor = 0.05 * (x[1] - x[0])
+        if self._interpolate and self._bank is None and _maxima.size:
+            # vertex of the parabola through the peak and its neighbours, within half a bin of the peak
+            _lower = y[_maxima - 1]
+            _upper = y[_maxima + 1]
+            _offset = 0.5 * (_lower - _upper) / (_lower - 2. * self._y + _upper)
+            self._x = self._x + _offset * (x[1] - x[0])
+            self._y = self._y - 0.25 * (_lower - _upper) * _offset
+
+    def load_bands(self, bands: list):
+        # peaks of every window picked on its own bins within its band, merged into one peak set
+        _x, _y, _gain, _floor = [], [], [], []
+        for (x, y), (lower, upper) in zip(bands, self._band_limits):
+            if upper <= lower:
+                continue
+            self.load(x, y, lower, upper)
+            _x.append(self._x)
+            _y.append(self._y)
+            _gain.append(self._gain)
+            _floor.append(full(self._x.size, self._floor))
+        self._x, self._y = concatenate(_x), concatenate(_y)
+        self._gain, self._floor = concatenate(_gain), concatenate(_floor)
+        # positions in the merged set, there is no single spectrum to index
+        self._maxima = arange(self._x.size)
+
+    def decide(self, chord: dict) -> dict:
+        # exponentially decayed vote over (root, tense), the strongest chord wins
+        self._chord_scores *= self._decay
+        if chord['root']:
+            _index, _tense = self.get_chord()
+            self._chord_scores[_index, _tense] += 1.
+        _root, _tense = divmod(int(argmax(self._chord_scores)), self._chord_scores.shape[1])
+        if self._chord_scores[_root, _tense] < self._mode_floor:
+            return self.set_chord(-1)
+        return self.set_chord(_root, _tense)
+
+    def get_chord(self) -> tuple:
+        # (root index or -1, tense: 0 for none, 1 for minor, 2 for major)
+        _tense = self._sound.index(self._tense) + 1 if self._tense else 0
+        return self._index, _tense
+
+    def set_chord(self, index: int, tense=0) -> dict:
+        if index < 0:
+            self._index, self._tonic, self._tense = -1, '', ''
+        else:
+            self._index = index
+            self._tonic = self._roots[index]
+            self._tense = self._sound[tense - 1] if tense else ''
+        return {'root': self._tonic, 'third': self._tense}
+
+    def evaluate(self, x: ndarray, y: ndarray) -> dict:
+        # this frame's chord, before the vote across frames
+        self.plan(x, y.size)
+        self.reset()
+        self._note_modes *= self._decay
+        self._note_modes[self._note_modes < self._mode_floor] = 0.
+        self.load(x, y)
+        return self.filter()
+
+    def evaluate_notes(self, x: ndarray, y: ndarray) -> dict:
+        # as evaluate, for per-semitone spectra such as NoteBankEngine
+        self.plan_notes(x)
+        self.reset()
+        self._note_modes *= self._decay
+        self._note_modes[self._note_modes < self._mode_floor] = 0.
+        self.load(x, y)
+        return self.filter()
+
+    def evaluate_bands(self, bands: list) -> dict:
+        # as evaluate, for multi-resolution frames: (x, y) per window, longest first
+        self.plan_bands(bands)
+        self.reset()
+        self._note_modes *= self._decay
+        self._note_modes[self._note_modes < self._mode_floor] = 0.
+        self.load_bands(bands)
+        return self.filter()
+
+    def update(self, x: ndarray, y: ndarray) -> dict:
+        _start = perf_counter()
+        chord = self.decide(self.evaluate(x, y))
+        metrics.since('filter', _start)
+        return chord
+
+    def update_notes(self, x: ndarray, y: ndarray) -> dict:
+        _start = perf_counter()
+        chord = self.decide(self.evaluate_notes(x, y))
+        metrics.since('filter', _start)
+        return chord
+
+    def update_bands(self, bands: list) -> dict:
+        _start = perf_counter()
+        chord = self.decide(self.evaluate_bands(bands))
+        metrics.since('filter', _start)
+        return chord
 
     def threshold(self) -> ndarray:
         return self._threshold
@@ -124,90 +367,59 @@ class TriadFilter:
         return self._profile_ticks, self._profile_g_win
 
     def get_max_mode(self) -> list:
-        _max = self._note_modes.index(max(self._note_modes))
-        _ret = []
-        for i in range(len(self._note_modes)):
-            if self._note_modes[i] == _max:
-                _ret.append(i)
-        return _ret
-
-    def build_profile(self, nl: NoteLabel):
-        if nl.octave >= self._octave_lower and nl.octave <= self._octave_upper:
-            _idx = nl.octave + (-1 * self._octave_lower)
-            _mag = self._profile_gains[nl.octave] * nl.magnitude
-            _win = int(nl.frequency / self._step)
-            nl.input = float(self._profile_g_win[_win] / (nl.magnitude * nl.error))
-            self._profile_distr[_idx] += nl.input
-            if self._verbose:
-                logger.debug('%.3f: %.3g to %.3f, err: %.3f, est: %f' % (
-                    nl.frequency, _mag, self._profile_g_win[_win],
-                    nl.error, nl.input ))
-        else:
-            logger.warning('out of range: %s at (%0.3f, %.3g)', nl.label, nl.frequency, nl.magnitude)
-
-    def build_histogram(self, histogram: list, index: int, nl: NoteLabel):
-        _octave = nl.octave
-        if _octave >= self._octave_lower and _octave <= self._octave_upper:
-            _idx = _octave + (-1 * self._octave_lower)
-            if index in self._note_set:
-                _distr = nl.input + self._profile_distr[_idx]
-                if histogram[index] < 0:
-                    histogram[index] = _distr
-                    return
-                histogram[index] += _distr
-        else:
-            logger.warning('skipping: %s in octave: %s', self._roots[index], _octave)
+        return flatnonzero(self._note_modes == self._note_modes.max()).tolist()
+
+    def build_profile(self):
+        _inside = (self._note_octave >= self._octave_lower) & (self._note_octave <= self._octave_upper)
+        if not _inside.all():
+            for i in flatnonzero(~_inside):
+                logger.warning('out of range: %s at (%0.3f, %.3g)',
+                               self._roots[self._note_index[i]], self._xx[i], self._yy[i])
+        _idx = self._note_octave[_inside] - self._octave_lower
+        _input = zeros(self._xx.size)
+        _input[_inside] = self._note_gain[_inside] / (self._yy[_inside] * self._note_error[_inside])
+        self._note_input = _input
+        self._profile_distr += bincount(_idx, weights=_input[_inside], minlength=self._profile_distr.size)
+        if self._verbose:
+            for f, m, w, e, i in zip(self._xx, self._yy, self._note_gain, self._note_error, _input):
+                logger.debug('%.3f: %.3g to %.3f, err: %.3f, est: %f' % (f, m, w, e, i))
+
+    def build_histograms(self) -> ndarray:
+        # (interval, note) histograms: note modes plus the weight of every peak an interval below each seen note
+        _inside = (self._note_octave >= self._octave_lower) & (self._note_octave <= self._octave_upper)
+        _weights = self._note_input[_inside] + self._profile_distr[self._note_octave[_inside] - self._octave_lower]
+        _chroma = bincount(self._note_index[_inside], weights=_weights, minlength=len(self._roots))
+        _seen = bincount(self._note_index, minlength=len(self._roots)) > 0
+        return self._note_modes + _seen * (self._shifts @ _chroma)
 
-    def parse_histogram(self, histogram: list, label='') -> int:
+    def parse_histogram(self, histogram: ndarray, label='') -> int:
         if self._verbose:
             logger.debug('parse (%s) histogram: %s', label, ['%.3g' % bar for bar in histogram])
-        return histogram.index(max(histogram))
+        return int(argmax(histogram))
+
+    def find_notes(self, frequencies: ndarray) -> tuple:
+        # (index, octave, cents, hz error) arrays for peaks already inside the filter range
+        _index, _octave, _cents = map_notes(frequencies, self._freqs[0])
+        _error = abs(frequencies * (1. - exp2(-_cents / 1200.)))
+        return _index, _octave, _cents, _error
 
     def find_note(self, value: float, magnitude=0.) -> (NoteLabel or None):
         if value >= self._lower_filter_limit and value <= self._upper_filter_limit:
-            if self._verbose:
-                logger.debug('finding: %.3f with mag: %.3g', value, magnitude)
-            note = NoteLabel()
-            note.frequency = value
-            note.magnitude = magnitude
-            # find octave shift
-            _upper = self._upper_window_limit
-            _lower = self._lower_window_limit
-            _octave = 0
-            _harmonic = value
-            if _harmonic > _upper:
-                while _harmonic > _upper:
-                    _harmonic /= 2
-                    _octave += 1
-            elif _harmonic < _lower:
-                while _harmonic < _lower:
-                    _harmonic *= 2
-                    _octave += 1
-                _octave *= -1
-            # apply shifted
-            if _octave < 0:
-                _freqs = [float(_f/(-2 * _octave)) for _f in self._freqs]
-            elif _octave > 0:
-                _freqs = [float(_f * (2 * _octave)) for _f in self._freqs]
-            else:
-                _freqs = self._freqs
-            note.octave = _octave
-            # find nearest
-            _value = [abs(float(value - i)) for i in _freqs]
-            _index = _value.index(min(_value))
-            note.index = _index
-            note.error = _value[_index]
+            _index, _octave, _cents, _error = self.find_notes(asarray([value]))
+            note = NoteLabel(value, magnitude)
+            note.index = int(_index[0])
+            note.octave = int(_octave[0])
+            note.error = float(_error[0])
             note.label = self._roots[note.index]
-            for interval in range(2, 8):
-                if interval is 3:
-                    note.third = [
-                        self.get_interval(_index, self._minor_3rd),
-                        self.get_interval(_index, self._major_3rd)
-                    ]
-                elif interval in [4, 5] and interval < 5:
-                    note.dominant[0] = self.get_interval(_index, self._dominant_4th)
-                    note.dominant[1] = self.get_interval(_index, self._dominant_dim)
-                    note.dominant[2] = self.get_interval(_index, self._dominant_5th)
+            note.third = [
+                self.get_interval(note.index, self._minor_3rd),
+                self.get_interval(note.index, self._major_3rd)
+            ]
+            note.dominant = [
+                self.get_interval(note.index, self._dominant_4th),
+                self.get_interval(note.index, self._dominant_dim),
+                self.get_interval(note.index, self._dominant_5th)
+            ]
             if self._verbose:
                 logger.debug('found: %s is "%s", shifted: %s', value, note.label, note.octave)
             return note
@@ -216,106 +428,72 @@ class TriadFilter:
         return None
 
     def find_maxima(self) -> bool:
-        for i, idx in zip(self._y, range(len(self._y))):
-            if i > self._magnitude:
-                self._yy.append(i)
-                self._xx.append(self._x[idx])
-        if self._yy:
-            self._note_labels = [self.find_note(x, y) for x, y in zip(self._xx, self._yy)]
-            if None in self._note_labels:
-                _temp = self._note_labels.copy()
-                self._note_labels.clear()
-                for i in range(len(_temp)):
-                    if _temp[i] is not None:
-                        self._note_labels.append(_temp[i])
-            if not self._note_labels:
-                return False
-            _max_mag = [note.magnitude for note in self._note_labels]
-            _max_idx = _max_mag.index(max(_max_mag))
-            _max_lbl = self._note_labels[_max_idx].index
-            _min_err = [note.error for note in self._note_labels]
-            _min_idx = _min_err.index(min(_min_err))
-            _min_lbl = self._note_labels[_min_idx].index
-            _spacing = abs(_max_lbl - _min_lbl)
-            if _spacing in [self._minor_3rd, self._major_3rd]:
-                if _max_lbl > _min_lbl:
-                    self._minmax_freq = self._note_labels[_min_idx]
-                    self._3rd_bias = [_min_lbl, _max_lbl]
-                else:
-                    self._minmax_freq = self._note_labels[_max_idx]
-                    self._3rd_bias = [_max_lbl, _min_lbl]
-            elif _spacing in [self._dominant_4th, self._dominant_5th]:
-                if _spacing == self._dominant_5th:
-                    self._minmax_freq = self._note_labels[_min_idx]
-                    self._5th_bias = [_min_lbl, _max_lbl]
-                else:
-                    self._minmax_freq = self._note_labels[_max_idx]
-                    self._5th_bias = [_max_lbl, _min_lbl]
-            else: # first pass guess
-                self._minmax_freq = self._note_labels[_max_idx]
-            self.change_root(self._minmax_freq.index)
-            self._note_set = [note.index for note in self._note_labels]
-            for i in self._note_set:
-                self._note_modes[i] += 1
-            logger.debug('max: (%s) _n: %s', self._minmax_freq.label, self._note_set)
-            if self._verbose:
-                logger.debug('labels _n: %s', [self._roots[i] for i in self._note_set])
-                logger.debug('modes: %s', self._note_modes)
-                logger.debug('_xx: %s', [str('%.3f' % note.frequency) for note in self._note_labels])
-                logger.debug('_yy: %s', [str('%.3g' % note.magnitude) for note in self._note_labels])
-                logger.debug('err: %s', [str('%.3f' % err) for err in _min_err])
-            logger.debug('err: min: %s (%d) %s: %.3f',
-                         _min_err[_min_idx],
-                         _min_idx,
-                         self._note_labels[_min_idx].label,
-                         self._note_labels[_min_idx].frequency
-            )
-            logger.debug('mag: max: %s (%d) %s: %.3f',
-                         _max_mag[_max_idx],
-                         _max_idx,
-                         self._note_labels[_max_idx].label,
-                         self._note_labels[_max_idx].frequency
-            )
-            return True
-        return False
+        # peaks were already thresholded and range limited by load
+        if not self._maxima.size:
+            return False
+        self._xx = self._x
+        self._yy = self._y
+        if self._bank is not None:
+            self._note_index = self._bank[1][self._maxima]
+            self._note_octave = self._bank[2][self._maxima]
+            self._note_cents = zeros(self._maxima.size)
+            self._note_error = self._bank[3][self._maxima]
+            self._note_gain = self._bank[4][self._maxima]
+        else:
+            self._note_index, self._note_octave, self._note_cents, self._note_error = self.find_notes(self._xx)
+            if self._interpolate:
+                # interpolated peaks are only good to a fraction of a bin, 1 / error would swamp the profile
+                maximum(self._note_error, self._floor, out=self._note_error)
+            self._note_gain = self._gain
+        _max_idx = int(argmax(self._yy))
+        _max_lbl = int(self._note_index[_max_idx])
+        _min_idx = int(argmin(self._note_error))
+        _min_lbl = int(self._note_index[_min_idx])
+        _spacing = abs(_max_lbl - _min_lbl)
+        if _spacing in [self._minor_3rd, self._major_3rd]:
+            if _max_lbl > _min_lbl:
+                self._minmax_freq = _min_idx
+                self._3rd_bias = [_min_lbl, _max_lbl]
+            else:
+                self._minmax_freq = _max_idx
+                self._3rd_bias = [_max_lbl, _min_lbl]
+        elif _spacing in [self._dominant_4th, self._dominant_5th]:
+            if _spacing == self._dominant_5th:
+                self._minmax_freq = _min_idx
+                self._5th_bias = [_min_lbl, _max_lbl]
+            else:
+                self._minmax_freq = _max_idx
+                self._5th_bias = [_max_lbl, _min_lbl]
+        else: # first pass guess
+            self._minmax_freq = _max_idx
+        self.change_root(int(self._note_index[self._minmax_freq]))
+        self._note_set = self._note_index.tolist()
+        self._note_modes += bincount(self._note_index, minlength=self._note_modes.size)
+        logger.debug('max: (%s) _n: %s', self._tonic, self._note_set)
+        if self._verbose:
+            logger.debug('labels _n: %s', [self._roots[i] for i in self._note_set])
+            logger.debug('modes: %s', self._note_modes)
+            logger.debug('_xx: %s', [str('%.3f' % x) for x in self._xx])
+            logger.debug('_yy: %s', [str('%.3g' % y) for y in self._yy])
+            logger.debug('err: %s', [str('%.3f' % err) for err in self._note_error])
+            logger.debug('cents: %s', [str('%.1f' % c) for c in self._note_cents])
+        logger.debug('err: min: %s (%d) %s: %.3f',
+                     self._note_error[_min_idx], _min_idx, self._roots[_min_lbl], self._xx[_min_idx])
+        logger.debug('mag: max: %s (%d) %s: %.3f',
+                     self._yy[_max_idx], _max_idx, self._roots[_max_lbl], self._xx[_max_idx])
+        return True
 
     def find_spacial_profile(self):
-        for nl in self._note_labels:
-            self.build_profile(nl)
+        self.build_profile()
         logger.debug('|--| spacial profile distribution: %s', [str('%.3f' % i) for i in self._profile_distr])
 
     def find_intervals(self):
-        for interval in range(2, 8):
-            _histogram_major = self._note_modes.copy()
-            _histogram_minor = self._note_modes.copy()
-            _histogram_dimin = self._note_modes.copy()
-            for nl in self._note_labels:
-                if interval is 3:
-                    self.build_histogram(_histogram_minor, nl.third[0], nl)
-                    self.build_histogram(_histogram_major, nl.third[1], nl)
-                elif interval in [4, 5] and interval < 5:
-                    self.build_histogram(_histogram_minor, nl.dominant[0], nl)
-                    self.build_histogram(_histogram_dimin, nl.dominant[1], nl)
-                    self.build_histogram(_histogram_major, nl.dominant[2], nl)
-            if interval is 3:
-                self._third[0] = self.test_root(self.parse_histogram(_histogram_minor, 'minor 3rd'))
-                self._third[1] = self.test_root(self.parse_histogram(_histogram_major, 'major 3rd'))
-                if nl.third[1] > -1 and nl.third[0] > -1:
-                    _max_minor = max(_histogram_minor)
-                    _max_major = max(_histogram_major)
-                    if self.get_interval(nl.third[0], self._dominant_5th) == \
-                            self.get_interval(nl.index, self._minor_3rd) or \
-                        (_max_minor > _max_major):
-                        nl.third[1] = -1
-                    elif (_max_major > _max_minor):
-                            nl.third[0] = -1
-                    else:
-                        nl.third[0] = -1
-                        nl.third[1] = -1
-            elif interval in [4, 5] and interval < 5:
-                self._dominant[0] = self.test_root(self.parse_histogram(_histogram_minor, '4th'))
-                self._dominant[1] = self.test_root(self.parse_histogram(_histogram_dimin, 'diminished'))
-                self._dominant[2] = self.test_root(self.parse_histogram(_histogram_major, '5th'))
+        _minor, _major, _4th, _dimin, _5th = self.build_histograms()
+        self._third[0] = self.test_root(self.parse_histogram(_minor, 'minor 3rd'))
+        self._third[1] = self.test_root(self.parse_histogram(_major, 'major 3rd'))
+        self._dominant[0] = self.test_root(self.parse_histogram(_4th, '4th'))
+        self._dominant[1] = self.test_root(self.parse_histogram(_dimin, 'diminished'))
+        self._dominant[2] = self.test_root(self.parse_histogram(_5th, '5th'))
 
     def set_major_minor_tense(self, index: int):
         if self._tense:
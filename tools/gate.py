@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from numpy import abs, ndarray, zeros
+from time import perf_counter
+from .metrics import metrics
+
+
+class ChangeGate:
+    # skips chord filter work while the spectrum holds still:
+    #   the filter's 12 bin chroma of each frame is compared with the last evaluated one, the chord already
+    #   decided is held without a new vote while the chroma moves less than `tolerance` (half the L1 distance
+    #   of the normalized chromas) and less than the filter's margin, so the frame could not give another chord,
+    #   and the last evaluated frame voted for the decided chord, so another vote would not change it
+    #   otherwise an LRU cache of `cache_size` per-frame chords keyed by the exact chroma is looked up before
+    #   the full filter runs, and the chord goes through the filter's vote as it would ungated
+    #   only filters whose per-frame chord depends on the frame's chroma alone can be gated
+    def __init__(self, triad, tolerance=0.05, cache_size=64):
+        if not triad.chroma_only:
+            raise ValueError('%s decides on more than the chroma of a frame' % type(triad).__name__)
+        self._triad = triad
+        self._tolerance = float(tolerance)
+        self._cache_size = int(cache_size)
+        self._cache = OrderedDict()
+        self._chroma = zeros(12)
+        self._normal = zeros(12)
+        self._margin = 0.
+        self._held = None
+        self.frames = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name: str):
+        # everything but update goes to the wrapped filter
+        return getattr(self._triad, name)
+
+    def gate(self, x: ndarray, y: ndarray, evaluate) -> dict:
+        _start = perf_counter()
+        self.frames += 1
+        self._triad.plan_chroma(x)
+        _chroma = self._triad.chroma(y)
+        _total = _chroma.sum()
+        _normal = _chroma / _total if _total else _chroma
+        if self._held is not None and 0.5 * abs(_normal - self._normal).sum() < self._tolerance \
+                and abs(_chroma - self._chroma).sum() < self._margin:
+            self.skipped += 1
+            chord = self._triad.set_chord(*self._held)
+        else:
+            self._chroma, self._normal = _chroma, _normal
+            _key = _chroma.tobytes()
+            _cached = self._cache.get(_key)
+            if _cached is not None:
+                self._cache.move_to_end(_key)
+                self.hits += 1
+            else:
+                self.misses += 1
+                evaluate(x, y)
+                _cached = self._cache[_key] = (self._triad.get_chord(), self._triad.margin())
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+            _chord, self._margin = _cached
+            chord = self._triad.decide(self._triad.set_chord(*_chord))
+            _decided = self._triad.get_chord()
+            self._held = _decided if _decided == _chord else None
+        metrics.since('filter', _start)
+        return chord
+
+    def update(self, x: ndarray, y: ndarray) -> dict:
+        return self.gate(x, y, self._triad.evaluate)
+
+    def update_notes(self, x: ndarray, y: ndarray) -> dict:
+        return self.gate(x, y, self._triad.evaluate_notes)
+
+    def stats(self) -> dict:
+        return {'frames': self.frames, 'skipped': self.skipped, 'hits': self.hits, 'misses': self.misses,
+                'cached': len(self._cache)}
@@ -1,12 +1,43 @@
 from pyqtgraph.Qt import QtCore, QtGui
 from pyqtgraph import GraphicsWindow, setConfigOptions
+from numpy import empty, ndarray
 
 from sys import flags
+from time import perf_counter
+from .metrics import metrics
+
+
+def decimate_minmax(_x: ndarray, _y: ndarray, width: int) -> tuple:
+    # keeps the min and max of every pixel column so narrow peaks survive decimation
+    _size = len(_y)
+    if width < 1 or _size <= 2 * width:
+        return _x, _y
+    _bucket = _size // width
+    _used = _bucket * width
+    _columns = _y[:_used].reshape(width, _bucket)
+    _tail = _size > _used
+    _points = 2 * (width + _tail)
+    _dx = empty(_points)
+    _dy = empty(_points)
+    _dx[0:2 * width:2] = _x[:_used:_bucket]
+    _dx[1:2 * width:2] = _x[_bucket - 1:_used:_bucket]
+    _columns.min(axis=1, out=_dy[0:2 * width:2])
+    _columns.max(axis=1, out=_dy[1:2 * width:2])
+    if _tail:
+        _dx[-2:] = _x[_used], _x[-1]
+        _dy[-2:] = _y[_used:].min(), _y[_used:].max()
+    return _dx, _dy
+
 
 class PlotSignalWindow():
-    def __init__(self, width=1000, height=600):
+    def __init__(self, width=1000, height=600, refresh_ms=16):
         # signal
         self.signal = dict()
+        # latest data per curve, pushed to the canvas on the refresh timer only
+        self._pending = dict()
+        self._static = dict()
+        self._width = width
+        self._refresh_ms = refresh_ms
         # setup window
         self.app = QtGui.QApplication([])
         self.win = GraphicsWindow(title="Plot Signal")
@@ -18,13 +49,35 @@ class PlotSignalWindow():
         # limit plot to 20Hz to 20kHz and clamp magnitude
         # self.canvas.setXRange(0, 20000)
         self.canvas.setYRange(0, 100000)
+        self._refresh = QtCore.QTimer()
+        self._refresh.timeout.connect(self.render)
 
     def start(self):
+        self._refresh.start(self._refresh_ms)
         if (flags.interactive != 1) or not hasattr(QtCore, 'PYQT_VERSION'):
             QtGui.QApplication.instance().exec_()
 
-    def draw(self, name: str, _x, _y, pen='y'):
-        if name in self.signal:
-            self.signal[name].setData(_x, _y)
-        else:
+    def pixels(self) -> int:
+        _width = int(self.canvas.getViewBox().width())
+        return _width if _width > 0 else self._width
+
+    def draw(self, name: str, _x, _y, pen='y', static=False):
+        # static curves are only redrawn when handed different arrays
+        if static:
+            _last = self._static.get(name)
+            if _last is not None and _last[0] is _x and _last[1] is _y:
+                return
+            self._static[name] = (_x, _y)
+        if name not in self.signal:
             self.signal[name] = self.canvas.plot(pen=pen)
+        self._pending[name] = (_x, _y)
+
+    def render(self):
+        if not self._pending:
+            return
+        _start = perf_counter()
+        _width = self.pixels()
+        for name, (_x, _y) in self._pending.items():
+            self.signal[name].setData(*decimate_minmax(_x, _y, _width))
+        self._pending.clear()
+        metrics.since('draw', _start)
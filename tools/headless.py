@@ -0,0 +1,81 @@
+from json import dumps
+from numpy import argmax, ndarray, sqrt
+from sys import stdout
+from time import monotonic, sleep
+from .log import logger
+
+
+class Scheduler:
+    # fixed rate loop without Qt, ticks are kept on the original grid instead of drifting
+    def __init__(self, period_ms: float, callback):
+        self._period = float(period_ms) / 1000.
+        self._callback = callback
+        self._exiting = False
+        self.late = 0
+
+    def run(self):
+        _next = monotonic()
+        while not self._exiting:
+            self._callback()
+            _next += self._period
+            _wait = _next - monotonic()
+            if _wait > 0:
+                sleep(_wait)
+            else:
+                # fell behind, skip the missed ticks
+                self.late += 1
+                _next = monotonic()
+        logger.debug('scheduler late ticks: %d', self.late)
+
+    def stop(self):
+        self._exiting = True
+
+
+class EventStream:
+    # json lines of chord changes and periodic spectrum summaries
+    def __init__(self, stream=stdout, summary_ms=250.):
+        self._stream = stream
+        self._summary = float(summary_ms) / 1000. if summary_ms else 0.
+        self._last_chord = dict()
+        self._last_summary = dict()
+        self._start = monotonic()
+
+    def emit(self, event: dict):
+        self._stream.write(dumps(event, ensure_ascii=False) + '\n')
+        self._stream.flush()
+
+    def chord(self, chord: dict, color=0, channel=None):
+        # `channel` tags events of multi-input captures, each input tracks its own changes
+        _chord = (chord['root'], chord['third'].strip())
+        if _chord == self._last_chord.get(channel):
+            return
+        self._last_chord[channel] = _chord
+        _event = {
+            'event': 'chord',
+            'time': round(monotonic() - self._start, 4),
+            'root': _chord[0],
+            'tense': _chord[1],
+            'color': color
+        }
+        if channel is not None:
+            _event['channel'] = channel
+        self.emit(_event)
+
+    def spectrum(self, x: ndarray, y: ndarray, channel=None):
+        _now = monotonic()
+        if not self._summary or _now - self._last_summary.get(channel, 0.) < self._summary or not len(y):
+            return
+        self._last_summary[channel] = _now
+        _peak = int(argmax(y))
+        _total = float(y.sum())
+        _event = {
+            'event': 'spectrum',
+            'time': round(_now - self._start, 4),
+            'peak_hz': round(float(x[_peak]), 3),
+            'peak': float(y[_peak]),
+            'centroid_hz': round(float((x * y).sum() / _total), 3) if _total else 0.,
+            'rms': float(sqrt((y * y).mean()))
+        }
+        if channel is not None:
+            _event['channel'] = channel
+        self.emit(_event)
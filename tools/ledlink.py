@@ -0,0 +1,240 @@
+from numpy import asarray, bincount, clip, floor, log2, maximum, ndarray, rint, uint8, zeros
+from time import monotonic
+from .filter import map_notes
+from .log import logger
+
+
+# every frame: [sync][type: seq << 4 | kind][payload bytes][payload][crc-8 of type, length and payload]
+#   sync never needs escaping, a receiver that loses its place drops bytes until a frame checks out
+SYNC = 0xA5
+CHORD, KEY, DELTA = 0x01, 0x02, 0x03
+# chord payload: [color byte as TriadFilter.get_color, 0 for none]
+# key payload:   [groups][4-bit levels, two per byte, low nibble first]
+# delta payload: [bit per group, set where the level changed][changed 4-bit levels, two per byte]
+#   a delta only applies on top of the level frame with the previous sequence number, otherwise the receiver
+#   waits for the next key frame
+LEVELS = 16
+MAX_GROUPS = 48
+# the sketch's frame buffer: a delta of every group
+MAX_PAYLOAD = (MAX_GROUPS + 7) // 8 + MAX_GROUPS // 2
+
+
+def crc8(data: bytes, crc=0) -> int:
+    # polynomial 0x07, as the sketch computes it byte by byte
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def encode_frame(kind: int, payload: bytes, seq=0) -> bytes:
+    _body = bytes([(seq & 0x0F) << 4 | kind, len(payload)]) + payload
+    return bytes([SYNC]) + _body + bytes([crc8(_body)])
+
+
+def pack_levels(levels: bytes) -> bytes:
+    _packed = bytearray((len(levels) + 1) // 2)
+    for i, level in enumerate(levels):
+        _packed[i >> 1] |= (level & 0x0F) << (4 * (i & 1))
+    return bytes(_packed)
+
+
+def unpack_levels(packed: bytes, count: int) -> bytes:
+    return bytes((packed[i >> 1] >> (4 * (i & 1))) & 0x0F for i in range(count))
+
+
+def quantize(values: ndarray, levels=LEVELS) -> bytes:
+    # 0..1 intensities to one level per byte
+    return clip(rint(asarray(values) * (levels - 1)), 0, levels - 1).astype(uint8).tobytes()
+
+
+class FrameEncoder:
+    # turns (color, levels) states into frames against what the receiver was last sent:
+    #   only changed levels travel, as a delta, unless a key frame is due or would be no larger
+    #   every `keyframe_s` the whole state goes out again, chord and key frame, changed or not, so a receiver
+    #   that lost a frame of either kind is repaired
+    def __init__(self, keyframe_s=1.):
+        self._keyframe_s = float(keyframe_s)
+        self._keyed = float('-inf')
+        self._color = None
+        self._levels = None
+        self._seq = 0
+        self.keys = 0
+        self.deltas = 0
+        self.chords = 0
+
+    def level_frame(self, levels: bytes, key=False) -> bytes:
+        self._seq = (self._seq + 1) & 0x0F
+        _key = bytes([len(levels)]) + pack_levels(levels)
+        if not key and self._levels is not None and len(levels) == len(self._levels):
+            _mask = bytearray((len(levels) + 7) // 8)
+            _changed = []
+            for i, (level, last) in enumerate(zip(levels, self._levels)):
+                if level != last:
+                    _mask[i >> 3] |= 1 << (i & 7)
+                    _changed.append(level)
+            _delta = bytes(_mask) + pack_levels(bytes(_changed))
+            if len(_delta) < len(_key):
+                self.deltas += 1
+                return encode_frame(DELTA, _delta, self._seq)
+        self.keys += 1
+        return encode_frame(KEY, _key, self._seq)
+
+    def encode(self, color: int, levels: bytes, now=None) -> bytes:
+        _now = monotonic() if now is None else now
+        _levels = levels[:MAX_GROUPS]
+        _key = _now - self._keyed >= self._keyframe_s
+        _data = b''
+        if color != self._color or _key:
+            self.chords += 1
+            _data += encode_frame(CHORD, bytes([color]))
+        if _levels and (_levels != self._levels or _key):
+            _data += self.level_frame(_levels, _key)
+        if _key:
+            self._keyed = _now
+        self._color = color
+        self._levels = _levels
+        return _data
+
+    def refresh(self, now=None) -> bytes:
+        # the last state again once it is due, for links that went quiet
+        _now = monotonic() if now is None else now
+        if self._color is None or _now - self._keyed < self._keyframe_s:
+            return b''
+        return self.encode(self._color, self._levels or b'', _now)
+
+    def reset(self):
+        # what the receiver holds is unknown, e.g. after a failed write: the next state goes out whole
+        self._keyed = float('-inf')
+
+    def stats(self) -> dict:
+        return {'keys': self.keys, 'deltas': self.deltas, 'chords': self.chords}
+
+
+class FrameDecoder:
+    # the sketch's parser in python, for loopback tests: feed it bytes, read color and levels back
+    #   a byte at a time through sync, type, length, payload and crc; a frame that fails its crc is dropped
+    #   whole, until the first frame, single bytes below 0x80 are legacy chord colors
+    def __init__(self):
+        self.color = 0
+        self.levels = b''
+        self._seq = -1
+        self._state = 0
+        self._type = 0
+        self._length = 0
+        self._crc = 0
+        self._payload = bytearray()
+        self.frames = 0
+        self.legacy = 0
+        self.crc_errors = 0
+        self.gaps = 0
+
+    def gap(self):
+        # a level frame went missing, nothing applies until the next key frame
+        self.gaps += 1
+        self._seq = -1
+
+    def apply(self, kind: int, seq: int, payload: bytes):
+        self.frames += 1
+        if kind == CHORD and len(payload) == 1:
+            self.color = payload[0]
+        elif kind == KEY and payload and payload[0] <= MAX_GROUPS and len(payload) == 1 + (payload[0] + 1) // 2:
+            self.levels = unpack_levels(payload[1:], payload[0])
+            self._seq = seq
+        elif kind == DELTA:
+            _groups = len(self.levels)
+            _mask = payload[:(_groups + 7) // 8]
+            if self._seq < 0 or seq != (self._seq + 1) & 0x0F or len(_mask) < (_groups + 7) // 8:
+                return self.gap()
+            _changed = [i for i in range(_groups) if _mask[i >> 3] >> (i & 7) & 1]
+            if len(payload) != len(_mask) + (len(_changed) + 1) // 2:
+                return self.gap()
+            _levels = bytearray(self.levels)
+            for i, value in zip(_changed, unpack_levels(payload[len(_mask):], len(_changed))):
+                _levels[i] = value
+            self.levels = bytes(_levels)
+            self._seq = seq
+
+    def parse(self, byte: int):
+        if self._state == 0:
+            if byte == SYNC:
+                self._state = 1
+            elif not self.frames and 0 < byte < 0x80:
+                self.color = byte
+                self.legacy += 1
+        elif self._state == 1:
+            self._type = byte
+            self._crc = crc8((byte,))
+            self._state = 2
+        elif self._state == 2:
+            if byte > MAX_PAYLOAD:
+                self.crc_errors += 1
+                self._state = 0
+                return
+            self._length = byte
+            self._payload = bytearray()
+            self._crc = crc8((byte,), self._crc)
+            self._state = 3 if byte else 4
+        elif self._state == 3:
+            self._payload.append(byte)
+            self._crc = crc8((byte,), self._crc)
+            if len(self._payload) == self._length:
+                self._state = 4
+        else:
+            self._state = 0
+            if byte != self._crc:
+                self.crc_errors += 1
+                return
+            self.apply(self._type & 0x0F, self._type >> 4, bytes(self._payload))
+
+    def feed(self, data: bytes) -> int:
+        # returns the frames applied
+        _frames = self.frames
+        for byte in data:
+            self.parse(byte)
+        return self.frames - _frames
+
+    def stats(self) -> dict:
+        return {'frames': self.frames, 'legacy': self.legacy, 'crc_errors': self.crc_errors, 'gaps': self.gaps}
+
+
+class LevelMeter:
+    # 0..1 intensity per LED group of a spectrum: 12 groups fold it onto notes, any other count splits
+    #   A1 to C8 into log spaced bands; magnitude above `threshold` is summed per group and scaled by a
+    #   slowly decaying peak, so quiet passages still use the range
+    def __init__(self, groups=12, threshold=2e+4, lower=55., upper=4186.01, decay=0.995):
+        self._groups = int(groups)
+        if not 0 < self._groups <= MAX_GROUPS:
+            raise ValueError('between 1 and %d LED groups, got: %d' % (MAX_GROUPS, self._groups))
+        self._threshold = float(threshold)
+        self._lower = float(lower)
+        self._upper = float(upper)
+        self._decay = float(decay)
+        self._peak = 0.
+        self._x = None
+        self._inside = None
+        self._group = None
+
+    def plan(self, x: ndarray):
+        if self._x is x:
+            return
+        _x = maximum(x, 1e-9)
+        self._inside = (x >= self._lower) & (x <= self._upper)
+        if self._groups == 12:
+            self._group = map_notes(_x[self._inside])[0]
+        else:
+            _position = log2(_x[self._inside] / self._lower) / log2(self._upper / self._lower)
+            self._group = clip(floor(_position * self._groups), 0, self._groups - 1).astype(int)
+        logger.debug('planning led levels: %d groups over %d bins', self._groups, self._group.size)
+        self._x = x
+
+    def levels(self, x: ndarray, y: ndarray) -> ndarray:
+        self.plan(x)
+        _levels = bincount(self._group, weights=maximum(y[self._inside] - self._threshold, 0.),
+                           minlength=self._groups) if self._group.size else zeros(self._groups)
+        self._peak = max(self._peak * self._decay, float(_levels.max()))
+        return _levels / self._peak if self._peak else _levels
+
+    def quantized(self, x: ndarray, y: ndarray) -> bytes:
+        return quantize(self.levels(x, y))
@@ -0,0 +1,118 @@
+from numpy import exp
+from numpy.random import default_rng
+from threading import Event, Thread
+from time import monotonic, perf_counter, sleep
+from .bench import synth_triad
+from .capture import SpectrumEngine
+from .filter import TriadFilter
+from .ledlink import FrameDecoder, LevelMeter, quantize
+from .log import logger
+from .output import FramedOutput, PtySerial
+
+
+class LinkLoopback:
+    # the host side of the LED link against the sketch's parser over a pseudo terminal:
+    #   synthetic triads run through spectrum, chord filter and level meter, states go out through
+    #   FramedOutput paced to `baudrate`, and the far end decodes them with FrameDecoder;
+    #   `corrupt` / `drop` are per byte odds of a flipped bit / a lost byte on the line
+    def __init__(self, baudrate=9600, groups=12, fps=30., seconds=5., window_size=4096, bitrate=48100,
+                 threshold=2e+4, db_gain=1e-1, keyframe_s=1., corrupt=0., drop=0., seed=0):
+        self._baudrate = int(baudrate)
+        self._fps = float(fps)
+        self._seconds = float(seconds)
+        self._window_size = int(window_size)
+        self._bitrate = int(bitrate)
+        self._corrupt = float(corrupt)
+        self._drop = float(drop)
+        self._rng = default_rng(seed)
+        self._engine = SpectrumEngine(self._window_size, self._bitrate, db_gain=db_gain)
+        self._triad = TriadFilter(threshold=float(threshold))
+        self._meter = LevelMeter(groups, threshold=float(threshold))
+        self._device = PtySerial(self._baudrate)
+        self._output = FramedOutput(self._device, self._baudrate, keyframe_s)
+        self._decoder = FrameDecoder()
+        self._exiting = Event()
+        self.received = 0
+        self._reader = Thread(target=self.read, name='loopback-read', daemon=True)
+        logger.info('loopback: %d groups at %.1f fps over %s at %d baud', groups, self._fps, self._device.port,
+                    self._baudrate)
+
+    def line(self, data: bytes) -> bytes:
+        # line noise between host and device
+        if not self._corrupt and not self._drop:
+            return data
+        _data = bytearray()
+        for byte in data:
+            if self._rng.random() < self._drop:
+                continue
+            if self._rng.random() < self._corrupt:
+                byte ^= 1 << int(self._rng.integers(8))
+            _data.append(byte)
+        return bytes(_data)
+
+    def read(self):
+        while not self._exiting.is_set():
+            try:
+                _data = self._device.read()
+            except OSError:
+                break
+            self.received += len(_data)
+            self._decoder.feed(self.line(_data))
+
+    def states(self):
+        # yields (color, levels) per frame: a new triad every half second, decaying like a struck string
+        _chords = [(semitone, kind) for semitone in range(-12, 12, 5) for kind in ('maj', 'm')]
+        _signals = [synth_triad(semitone, kind, self._window_size, self._bitrate, seed=i)
+                    for i, (semitone, kind) in enumerate(_chords)]
+        _frames = int(0.5 * self._fps) or 1
+        for i in range(int(self._seconds * self._fps)):
+            _envelope = exp(-(i % _frames) / (0.25 * self._fps))
+            _x, _y = self._engine.transform(_envelope * _signals[i // _frames % len(_signals)])
+            chord = self._triad.update(_x, _y)
+            _color = self._triad.get_color() if chord['root'] else 0
+            yield _color, quantize(self._meter.levels(_x, _y))
+
+    def drain(self, keys=0, settle=0.2, timeout=5.):
+        # until the writer has sent more than `keys` key frames, the reader has everything the writer sent,
+        #   and the writer has stayed idle for `settle`
+        _until = monotonic() + timeout
+        _idle = None
+        while monotonic() < _until:
+            if self._output.stats()['keys'] > keys and self.received == self._output.sent_bytes:
+                _idle = _idle or monotonic()
+                if monotonic() - _idle >= settle:
+                    return
+            else:
+                _idle = None
+            sleep(0.01)
+        logger.warning('loopback: %d of %d bytes received', self.received, self._output.sent_bytes)
+
+    def run(self) -> dict:
+        self._reader.start()
+        _start = monotonic()
+        _last = None
+        for i, (color, levels) in enumerate(self.states()):
+            self._output.send_state(color, levels, perf_counter())
+            _last = (color, levels)
+            _wait = _start + (i + 1) / self._fps - monotonic()
+            if _wait > 0:
+                sleep(_wait)
+        # the next key frame repeats the last state whole, repairing whatever the line lost of it
+        self.drain(self._output.stats()['keys'])
+        _elapsed = monotonic() - _start
+        self._output.close()
+        self._exiting.set()
+        _results = {
+            'seconds': _elapsed,
+            'bytes_per_s': self.received / _elapsed,
+            'budget_bytes_per_s': self._baudrate / 10.,
+            'final_match': _last is not None and (self._decoder.color, self._decoder.levels) == _last
+        }
+        _results.update({'sent_%s' % key: value for key, value in self._output.stats().items()})
+        _results.update({'received_%s' % key: value for key, value in self._decoder.stats().items()})
+        logger.info('loopback: %(bytes_per_s).1f of %(budget_bytes_per_s).0f bytes/s, %(sent_sent)d writes, '
+                    '%(sent_keys)d key, %(sent_deltas)d delta, %(sent_chords)d chord frames, '
+                    '%(sent_dropped)d states coalesced', _results)
+        logger.info('loopback: %(received_frames)d frames decoded, %(received_crc_errors)d crc errors, '
+                    '%(received_gaps)d gaps, final state match: %(final_match)s', _results)
+        return _results
@@ -0,0 +1,164 @@
+from json import dumps
+from numpy import percentile, zeros
+from os import path as os_path, remove
+from threading import Event, Thread
+from time import monotonic, perf_counter
+from .log import logger
+
+
+class Stage:
+    # rolling window of the last `size` durations, written by a single thread
+    def __init__(self, size=1024):
+        self._samples = zeros(int(size))
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds: float):
+        self._samples[self.count % len(self._samples)] = seconds
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def summary(self) -> dict:
+        _ms = 1e3 * self._samples[:min(self.count, len(self._samples))]
+        _p50, _p95, _p99 = percentile(_ms, (50, 95, 99)) if len(_ms) else (0., 0., 0.)
+        return {
+            'count': self.count,
+            'mean_ms': 1e3 * self.total / self.count if self.count else 0.,
+            'p50_ms': float(_p50),
+            'p95_ms': float(_p95),
+            'p99_ms': float(_p99),
+            'max_ms': 1e3 * self.max
+        }
+
+
+class Metrics:
+    # per-stage latency windows and event counters, cheap enough to stay on in production:
+    #   _start = perf_counter(); ...; metrics.add('fft', perf_counter() - _start)
+    def __init__(self, size=1024):
+        self._size = int(size)
+        self._stages = dict()
+        self._counters = dict()
+        self._watches = dict()
+        self._start = monotonic()
+
+    def add(self, name: str, seconds: float):
+        _stage = self._stages.get(name)
+        if _stage is None:
+            _stage = self._stages[name] = Stage(self._size)
+        _stage.add(seconds)
+
+    def since(self, name: str, start: float):
+        self.add(name, perf_counter() - start)
+
+    def count(self, name: str, value=1):
+        self._counters[name] = self._counters.get(name, 0) + value
+
+    def watch(self, name: str, func):
+        # `func` returns a dict of stats sampled into every snapshot, e.g. ring or LED writer stats
+        self._watches[name] = func
+
+    def reset(self):
+        self._stages.clear()
+        self._counters.clear()
+        self._start = monotonic()
+
+    def snapshot(self) -> dict:
+        _snapshot = {
+            'uptime_s': round(monotonic() - self._start, 3),
+            'stages': {name: stage.summary() for name, stage in list(self._stages.items())},
+            'counters': dict(self._counters)
+        }
+        for name, func in list(self._watches.items()):
+            _snapshot[name] = func()
+        return _snapshot
+
+    def log(self):
+        for name, summary in sorted(self.snapshot()['stages'].items()):
+            logger.info('%-12s %8d  p50 %7.3f  p95 %7.3f  p99 %7.3f  max %7.3f ms', name, summary['count'],
+                        summary['p50_ms'], summary['p95_ms'], summary['p99_ms'], summary['max_ms'])
+        if self._counters:
+            logger.info('counters: %s', self._counters)
+
+
+metrics = Metrics()
+
+
+class MetricsExporter:
+    # appends a json snapshot to `path` every `period_s`, and / or serves the current one at `address`:
+    #   'host:port' or ':port' over http, 'unix:/path' (or any path) on a unix stream socket
+    def __init__(self, metrics=metrics, path=None, address=None, period_s=5.):
+        self._metrics = metrics
+        self._path = path
+        self._period = float(period_s)
+        self._server = None
+        self._socket = None
+        self._exiting = Event()
+        self._threads = []
+        if address:
+            self.serve(address)
+        if path:
+            self._threads.append(Thread(target=self.run, name='metrics-dump', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def serve(self, address: str):
+        # the server modules are imported here, most runs never serve metrics
+        if address.startswith('unix:') or '/' in address:
+            from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+
+            class MetricsSocketHandler(StreamRequestHandler):
+                def handle(self):
+                    self.wfile.write(dumps(self.server.metrics.snapshot()).encode() + b'\n')
+
+            self._socket = address[5:] if address.startswith('unix:') else address
+            if os_path.exists(self._socket):
+                remove(self._socket)
+            self._server = ThreadingUnixStreamServer(self._socket, MetricsSocketHandler)
+        else:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    _body = dumps(self.server.metrics.snapshot()).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(_body)))
+                    self.end_headers()
+                    self.wfile.write(_body)
+
+                def log_message(self, format, *args):
+                    logger.debug('metrics http: ' + format, *args)
+
+            _host, _, _port = address.rpartition(':')
+            self._server = ThreadingHTTPServer((_host or '127.0.0.1', int(_port)), MetricsHandler)
+        self._server.metrics = self._metrics
+        self._server.daemon_threads = True
+        self._threads.append(Thread(target=self._server.serve_forever, name='metrics-serve', daemon=True))
+        logger.info('serving metrics at: %s', address)
+
+    def dump(self):
+        with open(self._path, 'a') as f:
+            f.write(dumps(self._metrics.snapshot()) + '\n')
+
+    def run(self):
+        # waiting on the event keeps close responsive
+        while not self._exiting.wait(self._period):
+            try:
+                self.dump()
+            except (IOError, OSError) as e:
+                logger.error('metrics dump err: %s', e)
+
+    def close(self):
+        self._exiting.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            if self._socket and os_path.exists(self._socket):
+                remove(self._socket)
+        for thread in self._threads:
+            thread.join(timeout=1.)
+        if self._path:
+            self.dump()
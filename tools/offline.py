@@ -0,0 +1,106 @@
+from json import dumps
+from numpy import arange, float64, int16, memmap, ndarray
+from numpy.lib.stride_tricks import as_strided
+from struct import unpack
+from .capture import SpectrumEngine
+from .filter import TriadFilter
+from .log import logger
+from .templates import TemplateFilter
+
+
+def open_wav(path: str) -> tuple:
+    # memory maps the 16-bit PCM `data` chunk of a RIFF/WAVE file, returns (samples, bitrate)
+    with open(path, 'rb') as f:
+        riff, _, wave = unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError('not a RIFF/WAVE file: %s' % path)
+        _format = None
+        while True:
+            _header = f.read(8)
+            if len(_header) < 8:
+                raise ValueError('no data chunk in: %s' % path)
+            _id, _size = unpack('<4sI', _header)
+            if _id == b'fmt ':
+                _format = unpack('<HHIIHH', f.read(16))
+                f.seek(_size - 16 + (_size & 1), 1)
+            elif _id == b'data':
+                _offset = f.tell()
+                break
+            else:
+                f.seek(_size + (_size & 1), 1)
+    if _format is None:
+        raise ValueError('no fmt chunk in: %s' % path)
+    _tag, _channels, _bitrate, _, _, _bits = _format
+    if _tag not in (0x0001, 0xFFFE) or _bits != 16:
+        raise ValueError('only 16-bit PCM is supported, got format: 0x%04x, bits: %d' % (_tag, _bits))
+    _frames = _size // (2 * _channels)
+    return open_raw(path, _channels, _offset, _frames), _bitrate
+
+
+def open_raw(path: str, channels=1, offset=0, frames=None) -> ndarray:
+    # memory maps interleaved int16 samples, returns the first channel as a strided view
+    _shape = None if frames is None else (frames * channels,)
+    _data = memmap(path, dtype=int16, mode='r', offset=offset, shape=_shape)
+    _data = _data[:len(_data) - len(_data) % channels]
+    return _data.reshape(-1, channels)[:, 0]
+
+
+def frame_view(data: ndarray, window: int, hop: int) -> ndarray:
+    # zero-copy (frames, window) view of overlapping frames
+    _count = 1 + (len(data) - window) // hop if len(data) >= window else 0
+    _stride = data.strides[0]
+    return as_strided(data, shape=(_count, window), strides=(hop * _stride, _stride), writeable=False)
+
+
+class OfflineAnalysis:
+    def __init__(self, data: ndarray, bitrate: int, window_size=8192, hop_size=None, threshold=2e+4,
+                 db_gain=1e-1, single_tail=False, window='rect', batch=256, verbose=False, templates=False):
+        self._data = data
+        self._bitrate = bitrate
+        self._window_size = int(window_size)
+        self._hop_size = int(hop_size or window_size)
+        self._batch = int(batch)
+        self._templates = templates
+        _filter = TemplateFilter if templates else TriadFilter
+        self._triad = _filter(verbose=verbose, threshold=float(threshold))
+        self._engine = SpectrumEngine(self._window_size, bitrate, window, db_gain=db_gain, single_tail=single_tail)
+        self._frames = frame_view(data, self._window_size, self._hop_size)
+        logger.info('offline: %d samples at %d, %d frames of %d every %d',
+                    len(data), bitrate, len(self._frames), self._window_size, self._hop_size)
+
+    def frame_count(self) -> int:
+        return len(self._frames)
+
+    def spectra(self):
+        # yields (times, x, y) per batch, times are frame end positions in seconds
+        for _lower in range(0, len(self._frames), self._batch):
+            _block = self._frames[_lower:_lower + self._batch]
+            _x, _y = self._engine.transform_frames(_block)
+            _index = arange(_lower, _lower + len(_block), dtype=float64)
+            _times = (_index * self._hop_size + self._window_size) / self._bitrate
+            yield _times, _x, _y
+
+    def timeline(self, changes_only=True):
+        _last = None
+        for _times, _x, _y in self.spectra():
+            if self._templates:
+                # every frame of the batch is scored at once
+                _chords = self._triad.update_frames(_x, _y)
+            else:
+                _chords = (self._triad.update(_x, _row) for _row in _y)
+            for _time, chord in zip(_times, _chords):
+                _chord = (chord['root'], chord['third'].strip())
+                if changes_only and _chord == _last:
+                    continue
+                _last = _chord
+                yield {'time': round(float(_time), 4), 'root': _chord[0], 'tense': _chord[1]}
+
+
+def write_timeline(events, stream, fmt='csv'):
+    if fmt == 'csv':
+        stream.write('time,root,tense\n')
+    for event in events:
+        if fmt == 'csv':
+            stream.write('%(time).4f,%(root)s,%(tense)s\n' % event)
+        else:
+            stream.write(dumps(event, ensure_ascii=False) + '\n')
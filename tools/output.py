@@ -0,0 +1,201 @@
+from os import close as os_close, listdir, openpty, read as os_read, ttyname, write as os_write
+from queue import Empty, Full, Queue
+from threading import Thread
+from time import monotonic, perf_counter, sleep
+from .ledlink import FrameEncoder
+from .log import logger
+from .metrics import metrics
+
+
+def find_device(prefix='tty.usbmodem') -> str:
+    devs = sorted(filter(lambda x: x.startswith(prefix), listdir('/dev')))
+    if len(devs) > 0:
+        return '/dev/%s' % devs[0]
+    return ''
+
+
+def open_serial(device: str, baudrate=9600):
+    # pyserial is only needed once LEDs are attached
+    import serial
+    return serial.Serial(device, baudrate)
+
+
+class FakeSerial:
+    # stands in for serial.Serial, keeps everything written and takes as long as the link would
+    def __init__(self, port='fake', baudrate=9600, realtime=True):
+        self.port = port
+        self.baudrate = baudrate
+        self.written = bytearray()
+        self.writes = 0
+        self._realtime = realtime
+
+    def write(self, data: bytes) -> int:
+        if self._realtime:
+            sleep(10. * len(data) / self.baudrate)
+        self.written += data
+        self.writes += 1
+        logger.debug('fake serial %s: %s', self.port, bytes(data).hex())
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class PtySerial:
+    # stands in for serial.Serial on a pseudo terminal, the other end reads what a device would
+    def __init__(self, baudrate=9600):
+        import tty
+        self.baudrate = baudrate
+        self._master, self._slave = openpty()
+        # no echo, no line discipline: bytes pass as written
+        tty.setraw(self._slave)
+        self.port = ttyname(self._slave)
+
+    def write(self, data: bytes) -> int:
+        _view = memoryview(data)
+        while _view:
+            _view = _view[os_write(self._master, _view):]
+        return len(data)
+
+    def read(self, size=4096) -> bytes:
+        # device side
+        return os_read(self._slave, size)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        for fd in (self._master, self._slave):
+            try:
+                os_close(fd)
+            except OSError:
+                pass
+
+
+class LedOutput:
+    # background writer with a bounded queue:
+    #   repeated messages are skipped, a full queue drops its oldest message,
+    #   bytes are paced to the link's budget of baudrate / 10 (8N1) per second
+    def __init__(self, device, baudrate=9600, queue_size=4, burst=16, coalesce=True):
+        self._device = device
+        self._rate = float(baudrate) / 10.
+        self._burst = float(burst)
+        self._tokens = self._burst
+        self._refilled = monotonic()
+        self._coalesce = coalesce
+        self._queue = Queue(maxsize=queue_size)
+        self._last = None
+        self._exiting = False
+        self.sent = 0
+        self.sent_bytes = 0
+        self.unchanged = 0
+        self.dropped = 0
+        self._thread = Thread(target=self.run, name='led-output', daemon=True)
+        self._thread.start()
+
+    def send(self, message: bytes, captured_at=0.) -> bool:
+        # `captured_at` is the perf_counter of the audio behind the message, for audio to LED latency
+        if message == self._last:
+            self.unchanged += 1
+            return False
+        self._last = message
+        while True:
+            try:
+                self._queue.put_nowait((message, captured_at))
+                return True
+            except Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except Empty:
+                    pass
+
+    def budget(self, size: int):
+        # token bucket, sleeps until `size` bytes fit the link
+        _now = monotonic()
+        self._tokens = min(self._burst, self._tokens + (_now - self._refilled) * self._rate)
+        self._refilled = _now
+        if self._tokens < size:
+            sleep((size - self._tokens) / self._rate)
+            self._tokens = size
+            self._refilled = monotonic()
+        self._tokens -= size
+
+    def encode(self, message) -> bytes:
+        # writer thread: queued message to the bytes on the wire, None when the queue stayed empty
+        return message
+
+    def failed(self):
+        # writer thread: the last encoded bytes never reached the device
+        pass
+
+    def run(self):
+        while not self._exiting or not self._queue.empty():
+            try:
+                message, captured_at = self._queue.get(timeout=0.1)
+            except Empty:
+                message, captured_at = None, 0.
+            if self._coalesce and message is not None:
+                # only the newest of the waiting messages is still worth sending
+                while True:
+                    try:
+                        message, captured_at = self._queue.get_nowait()
+                        self.dropped += 1
+                    except Empty:
+                        break
+            _data = self.encode(message)
+            if not _data:
+                continue
+            self.budget(len(_data))
+            _start = perf_counter()
+            try:
+                self._device.write(_data)
+                self.sent += 1
+                self.sent_bytes += len(_data)
+            except (IOError, OSError) as e:
+                logger.error('led output err: %s', e)
+                metrics.count('serial_errors')
+                self.failed()
+                continue
+            _now = perf_counter()
+            metrics.add('serial', _now - _start)
+            if captured_at:
+                metrics.add('audio_to_led', _now - captured_at)
+
+    def stats(self) -> dict:
+        return {'sent': self.sent, 'bytes': self.sent_bytes, 'unchanged': self.unchanged, 'dropped': self.dropped}
+
+    def close(self):
+        self._exiting = True
+        self._thread.join(timeout=2.)
+        logger.info('led output sent: %(sent)d (%(bytes)d bytes), unchanged: %(unchanged)d, dropped: %(dropped)d',
+                    self.stats())
+        self._device.close()
+
+
+class FramedOutput(LedOutput):
+    # LedOutput speaking the framed protocol of tools.ledlink: messages are whole (color, levels) states,
+    #   so coalescing keeps the newest, and frames are encoded against what was actually written; an idle
+    #   link still repeats the last state every key frame interval, a failed write forces it out whole
+    def __init__(self, device, baudrate=9600, keyframe_s=1., queue_size=4, burst=32):
+        self._encoder = FrameEncoder(keyframe_s)
+        super().__init__(device, baudrate, queue_size, burst, coalesce=True)
+
+    def send_state(self, color: int, levels: bytes, captured_at=0.) -> bool:
+        return self.send((color, levels), captured_at)
+
+    def encode(self, message) -> bytes:
+        if message is None:
+            return self._encoder.refresh()
+        return self._encoder.encode(*message)
+
+    def failed(self):
+        self._encoder.reset()
+
+    def stats(self) -> dict:
+        _stats = super().stats()
+        _stats.update(self._encoder.stats())
+        return _stats
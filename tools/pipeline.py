@@ -0,0 +1,122 @@
+from multiprocessing import Event, Process
+from numpy import empty, float64, int16
+from signal import signal, SIGINT, SIG_IGN
+from time import sleep
+from .capture import AudioCapture, SpectrumEngine
+from .filter import TriadFilter
+from .log import logger
+from .templates import TemplateFilter
+from .ring import SharedRing
+
+
+def capture_main(audio_spec: tuple, exiting, window_size: int, hop_size: int, bitrate: int, buffer_size: int):
+    signal(SIGINT, SIG_IGN)
+    ring = SharedRing.attach(audio_spec)
+    audio = AudioCapture(window_size, hop_size, ring=ring, bitrate=bitrate, buffer_size=buffer_size)
+    audio.open_input_stream()
+    while not exiting.is_set():
+        audio.record(forever=False)
+    audio.close()
+    ring.close()
+
+
+def analysis_main(audio_spec: tuple, spectra_spec: tuple, exiting, window_size: int, hop_size: int,
+                  bitrate: int, threshold: float, db_gain: float, single_tail: bool, verbose: bool, templates: bool):
+    signal(SIGINT, SIG_IGN)
+    audio = SharedRing.attach(audio_spec)
+    spectra = SharedRing.attach(spectra_spec)
+    engine = SpectrumEngine(window_size, bitrate, db_gain=db_gain, single_tail=single_tail)
+    triad = (TemplateFilter if templates else TriadFilter)(verbose=verbose, threshold=threshold)
+    _frame = empty(window_size, dtype=int16)
+    # record layout: [spectrum bins][root index][tense][audio frames dropped so far]
+    _record = empty(spectra_spec[0] // Pipeline.slots, dtype=float64)
+    _bins = len(_record) - 3
+    _poll = 0.25 * hop_size / bitrate
+    audio.reset()
+    while not exiting.is_set():
+        # a slow frame drops the backlog instead of falling further behind the capture
+        if not audio.read_frame(_frame, hop_size, latest=True):
+            sleep(_poll)
+            continue
+        _x, _y = engine.transform(_frame, out=_record[:_bins])
+        triad.update(_x, _y)
+        _record[_bins:_bins + 2] = triad.get_chord()
+        _record[-1] = audio.dropped
+        spectra.write(_record)
+    logger.info('analysis frames: %(frames)d, dropped: %(dropped)d, overruns: %(overruns)d', audio.stats())
+    spectra.close()
+    audio.close()
+
+
+class Pipeline:
+    # capture -> analysis processes, handing frames over shared memory rings to the rendering process
+    slots = 8
+
+    def __init__(self, window_size=8192, hop_size=None, bitrate=48100, threshold=2e+4, db_gain=1e-1,
+                 single_tail=False, verbose=False, ring_size=None, templates=False, buffer_size=8192):
+        self._window_size = int(window_size)
+        self._hop_size = int(hop_size or window_size)
+        # the capture ring matches the one AudioCapture builds around its capture buffer
+        _ring_size = int(ring_size or 4 * max(self._window_size, self._hop_size, buffer_size))
+        self._engine = SpectrumEngine(self._window_size, bitrate, db_gain=db_gain, single_tail=single_tail)
+        self._x = self._engine.frequencies()
+        self._bins = len(self._x)
+        self._record = empty(self._bins + 3, dtype=float64)
+        self._dropped = 0
+        self._audio = SharedRing(_ring_size, int16, max_block=int(buffer_size))
+        self._spectra = SharedRing(self.slots * len(self._record), float64, max_block=len(self._record))
+        self._exiting = Event()
+        self._processes = [
+            Process(
+                target=capture_main, name='capture', daemon=True,
+                args=(self._audio.spec(), self._exiting, self._window_size, self._hop_size, int(bitrate),
+                      int(buffer_size))
+            ),
+            Process(
+                target=analysis_main, name='analysis', daemon=True,
+                args=(self._audio.spec(), self._spectra.spec(), self._exiting, self._window_size,
+                      self._hop_size, bitrate, float(threshold), float(db_gain), bool(single_tail), verbose,
+                      bool(templates))
+            )
+        ]
+        logger.info('Pipeline settings:')
+        logger.info('  window_size: %d, hop_size: %d, ring_size: %d, spectrum bins: %d',
+                    self._window_size, self._hop_size, _ring_size, self._bins)
+
+    @property
+    def has_captured(self) -> bool:
+        return self._spectra.frame_ready(len(self._record))
+
+    @property
+    def finished(self) -> bool:
+        return False
+
+    def start(self):
+        for process in self._processes:
+            process.start()
+
+    def read(self) -> (tuple or None):
+        # newest (x, y, root index, tense), stale spectra are skipped
+        if not self._spectra.read_frame(self._record, len(self._record), latest=True):
+            return None
+        self._dropped = int(self._record[-1])
+        return self._x, self._record[:self._bins], int(self._record[-3]), int(self._record[-2])
+
+    def frame_stats(self) -> dict:
+        # spectra read here, audio frames the analysis process dropped to stay on the newest, spectra skipped here
+        _stats = self._spectra.stats()
+        return {'frames': _stats['frames'], 'dropped': self._dropped, 'skipped': _stats['dropped'],
+                'overruns': _stats['overruns']}
+
+    def close(self):
+        self._exiting.set()
+        logger.info('pipeline frames: %(frames)d, dropped: %(dropped)d, skipped: %(skipped)d, overruns: %(overruns)d',
+                    self.frame_stats())
+        for process in self._processes:
+            if process.pid is not None:
+                process.join(timeout=2.)
+                if process.is_alive():
+                    logger.warning('terminating %s process', process.name)
+                    process.terminate()
+        self._spectra.close()
+        self._audio.close()
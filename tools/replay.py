@@ -0,0 +1,107 @@
+from numpy import dtype as as_dtype, memmap, ndarray
+from os import path as os_path
+from struct import calcsize, pack, unpack
+from time import monotonic, perf_counter, sleep
+from .capture import AudioCapture
+from .log import logger
+
+
+# [magic][bitrate][inputs][block size][padding] then records of [float64 seconds][int16 (inputs, block size)]
+MAGIC = b'HRMREC1\x00'
+HEADER = '<8sIII12x'
+
+
+def record_dtype(inputs: int, block_size: int):
+    return as_dtype([('time', '<f8'), ('samples', '<i2', (inputs, block_size))])
+
+
+def open_recording(path: str) -> tuple:
+    # memory maps a StreamRecorder file, returns (records, bitrate); a torn last record is left out
+    with open(path, 'rb') as f:
+        magic, bitrate, inputs, block_size = unpack(HEADER, f.read(calcsize(HEADER)))
+    if magic != MAGIC:
+        raise ValueError('not a stream recording: %s' % path)
+    _dtype = record_dtype(inputs, block_size)
+    _count = (os_path.getsize(path) - calcsize(HEADER)) // _dtype.itemsize
+    if not _count:
+        raise ValueError('empty stream recording: %s' % path)
+    return memmap(path, dtype=_dtype, mode='r', offset=calcsize(HEADER), shape=(_count,)), bitrate
+
+
+class StreamRecorder:
+    # appends every captured block with its arrival time, in seconds since the recorder opened
+    def __init__(self, path: str, bitrate: int, inputs: int, block_size: int):
+        self._path = path
+        self._inputs = int(inputs)
+        self._block_size = int(block_size)
+        self._record = ndarray((1,), dtype=record_dtype(self._inputs, self._block_size))
+        self._file = open(path, 'wb')
+        self._file.write(pack(HEADER, MAGIC, int(bitrate), self._inputs, self._block_size))
+        self._start = monotonic()
+        self.blocks = 0
+        logger.info('recording %d x %d sample blocks at %d to: %s', self._inputs, self._block_size, bitrate, path)
+
+    def write(self, block: ndarray):
+        # capture thread: one copy into the preallocated record, one buffered write
+        self._record['time'] = monotonic() - self._start
+        self._record['samples'][0] = block.reshape(self._inputs, self._block_size)
+        self._file.write(self._record.data)
+        self.blocks += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            logger.info('recorded %d blocks to: %s', self.blocks, self._path)
+
+
+class ReplayCapture(AudioCapture):
+    # AudioCapture fed from a StreamRecorder file instead of a microphone:
+    #   `speed` 1 keeps the recorded timing, N plays N times faster, 0 as fast as the consumer reads
+    #   as fast as possible waits for the consumer instead of dropping frames, so every frame is analyzed
+    def __init__(self, path: str, window_size=None, hop_size=None, speed=1., loop=False, latest=None,
+                 resolutions=None):
+        self._records, _bitrate = open_recording(path)
+        _inputs, _block_size = self._records.dtype['samples'].shape
+        self._speed = float(speed)
+        self._loop = loop
+        self._finished = False
+        self.blocks = 0
+        super().__init__(window_size, hop_size, latest=bool(self._speed) if latest is None else latest,
+                         channels=_inputs, bitrate=_bitrate, buffer_size=_block_size, resolutions=resolutions)
+        logger.info('  replay: %s, %d blocks, %.1f s, speed: %s', path, len(self._records),
+                    float(self._records[-1]['time'] - self._records[0]['time']), self._speed or 'max')
+
+    @property
+    def finished(self) -> bool:
+        return self._finished and not self.has_captured
+
+    def open_input_stream(self, purge=False):
+        self._input_stream = self._records
+
+    def record(self, forever=True):
+        _samples = self._records['samples']
+        _times = self._records['time']
+        # the consumer advances its read position before copying a frame out and keeps a block clear of the one
+        #   being written, so keep a hop and two blocks clear as well
+        _room = self._ring.capacity - 2 * self._buffer_size - max(self._window_size, self._hop_size)
+        self._running = True
+        while not self._exiting:
+            _start = perf_counter()
+            for i in range(len(self._records)):
+                if self._exiting:
+                    break
+                if self._speed:
+                    _wait = _start + (_times[i] - _times[0]) / self._speed - perf_counter()
+                    if _wait > 0:
+                        sleep(_wait)
+                else:
+                    # back pressure: never overwrite what the consumer has not read yet
+                    while self._ring.pending > _room and not self._exiting:
+                        sleep(0.0005)
+                self.push(_samples[i] if self._inputs > 1 else _samples[i, 0])
+                self.blocks += 1
+            if not self._loop:
+                break
+        self._finished = True
+        self._running = False
+        logger.debug('replayed blocks: %d', self.blocks)
@@ -0,0 +1,139 @@
+from multiprocessing.shared_memory import SharedMemory
+from numpy import dtype as as_dtype, int16, int64, ndarray, zeros
+from .log import logger
+
+
+class RingBuffer:
+    # single-producer / single-consumer sample ring:
+    #   the producer only advances the written counter, the consumer only advances `_read`,
+    #   both are monotonic sample counters so no lock is needed between threads
+    #   `buffer` and `counter` may live in shared memory to cross processes
+    #   with `channels` samples are kept deinterleaved as (channels, capacity), frames as (channels, window)
+    #   the producer fills up to `max_block` slots past the published counter before advancing it, so readers keep
+    #   that much clear of it; rings sized to four of their largest block by default
+    def __init__(self, capacity: int, dtype=int16, buffer=None, counter=None, channels=None, max_block=None):
+        self._capacity = int(capacity)
+        self._max_block = int(max_block) if max_block else self._capacity // 4
+        # the oldest sample a reader may still touch is this far behind the published counter
+        self._span = self._capacity - self._max_block
+        _shape = (int(channels), self._capacity) if channels else (self._capacity,)
+        self._buffer = zeros(_shape, dtype=dtype) if buffer is None else buffer
+        self._counter = zeros(1, dtype=int64) if counter is None else counter
+        self._read = int(self._counter[0])
+        self.frames = 0
+        self.dropped = 0
+        self.overruns = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def max_block(self) -> int:
+        return self._max_block
+
+    @property
+    def written(self) -> int:
+        return int(self._counter[0])
+
+    @property
+    def pending(self) -> int:
+        # samples written but not yet read, only meaningful in the consumer's process
+        return int(self._counter[0]) - self._read
+
+    def write(self, data: ndarray):
+        _size = data.shape[-1]
+        _written = int(self._counter[0])
+        if _size > self._capacity:
+            # only the newest samples can survive a write larger than the ring
+            _written += _size - self._capacity
+            data = data[..., -self._capacity:]
+            _size = self._capacity
+        _start = _written % self._capacity
+        _first = min(_size, self._capacity - _start)
+        self._buffer[..., _start:_start + _first] = data[..., :_first]
+        if _first < _size:
+            self._buffer[..., :_size - _first] = data[..., _first:]
+        # publish only after the samples are in place
+        self._counter[0] = _written + _size
+
+    def copy(self, out: ndarray, start: int) -> bool:
+        _size = out.shape[-1]
+        _start = start % self._capacity
+        _first = min(_size, self._capacity - _start)
+        out[..., :_first] = self._buffer[..., _start:_start + _first]
+        if _first < _size:
+            out[..., _first:] = self._buffer[..., :_size - _first]
+        # the producer may have lapped us while copying, or be filling the slots just copied, which tears the frame
+        return bool(self._counter[0] - start <= self._span)
+
+    def frame_ready(self, window: int) -> bool:
+        return bool(self._counter[0] - self._read >= window)
+
+    def read_frame(self, out: ndarray, hop: int, latest=False) -> bool:
+        _window = out.shape[-1]
+        _written = int(self._counter[0])
+        if _written - self._read < _window:
+            return False
+        _skip = 0
+        if latest:
+            # jump to the newest complete frame on the hop grid
+            _skip = (_written - _window - self._read) // hop
+        elif _written - self._read > self._span:
+            # producer overran the consumer, resync to the oldest frame clear of the block being written
+            _skip = -(-(_written - self._span - self._read) // hop)
+        if _skip:
+            self._read += _skip * hop
+            self.dropped += _skip
+        _start = self._read
+        self._read += hop
+        if not self.copy(out, _start):
+            self.overruns += 1
+            logger.debug('ring overrun at sample: %d', _start)
+            return False
+        self.frames += 1
+        return True
+
+    def reset(self):
+        self._read = int(self._counter[0])
+
+    def stats(self) -> dict:
+        return {'frames': self.frames, 'dropped': self.dropped, 'overruns': self.overruns}
+
+
+class SharedRing(RingBuffer):
+    # RingBuffer laid out in a named shared memory block: [int64 written counter][samples]
+    #   created by the owning process, attached by name from producer / consumer processes
+    def __init__(self, capacity: int, dtype=int16, name=None, max_block=None):
+        _dtype = as_dtype(dtype)
+        self._owner = name is None
+        _size = _dtype.itemsize * int(capacity) + 8
+        if self._owner:
+            self._shm = SharedMemory(create=True, size=_size)
+        else:
+            try:
+                # only the owner should unlink the block on exit
+                self._shm = SharedMemory(name=name, track=False)
+            except TypeError:
+                self._shm = SharedMemory(name=name)
+        _counter = ndarray((1,), dtype=int64, buffer=self._shm.buf)
+        if self._owner:
+            _counter[0] = 0
+        _buffer = ndarray((int(capacity),), dtype=_dtype, buffer=self._shm.buf, offset=8)
+        super().__init__(capacity, _dtype, _buffer, _counter, max_block=max_block)
+
+    def spec(self) -> tuple:
+        # picklable arguments to attach from another process
+        return self._capacity, self._buffer.dtype.str, self._shm.name, self._max_block
+
+    @classmethod
+    def attach(cls, spec: tuple) -> 'SharedRing':
+        capacity, dtype, name, max_block = spec
+        return cls(capacity, dtype, name, max_block)
+
+    def close(self):
+        # views into the block must be released before it can be closed
+        del self._buffer, self._counter
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,243 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from json import dumps
+from numpy import arange, array, empty, float64, int8, multiply, searchsorted
+from numpy.lib.format import open_memmap
+from os import cpu_count, path as os_path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from wave import open as open_wave
+from .bench import ROOTS, TRIADS, synth_triad
+from .capture import SpectrumEngine
+from .filter import TriadFilter
+from .log import logger
+from .offline import frame_view, open_raw, open_wav
+from .templates import TemplateFilter
+
+
+# tense codes as returned by get_chord, 0 for no chord
+TENSES = {'': 0, 'm': 1, 'maj': 2, 'dim': 3, 'aug': 4}
+
+
+def root_index(name: str) -> int:
+    # 'C', 'C♯', 'D♭', 'C#', 'Db' or 'C♯|D♭' as analyze-harmonics writes it -> index in ROOTS, -1 for no chord
+    _name = name.strip().replace('#', '♯')
+    if len(_name) == 2 and _name[1] == 'b':
+        _name = _name[0] + '♭'
+    if not _name:
+        return -1
+    for i, root in enumerate(ROOTS):
+        if _name == root or _name in root.split('|'):
+            return i
+    raise ValueError('unknown root: %s' % name)
+
+
+def label_path(path: str) -> str:
+    return os_path.splitext(path)[0] + '.csv'
+
+
+def read_labels(path: str) -> tuple:
+    # analyze-harmonics csv timeline (time,root,tense), each chord holds until the next row:
+    #   returns (times, root indexes, tense codes)
+    _times, _roots, _tenses = [], [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            _fields = [field.strip() for field in line.split(',')]
+            if not _fields[0] or _fields[0] == 'time':
+                continue
+            _fields += [''] * (3 - len(_fields))
+            _times.append(float(_fields[0]))
+            _roots.append(root_index(_fields[1]))
+            _tenses.append(TENSES[_fields[2]] if _roots[-1] >= 0 else 0)
+    return array(_times), array(_roots, dtype=int8), array(_tenses, dtype=int8)
+
+
+def label_frames(labels: tuple, times) -> tuple:
+    # (root indexes, tense codes) in force at every frame time, no chord before the first label
+    _times, _roots, _tenses = labels
+    _at = searchsorted(_times, times, side='right') - 1
+    _none = _at < 0
+    _roots, _tenses = _roots[_at], _tenses[_at]
+    _roots[_none] = -1
+    _tenses[_none] = 0
+    return _roots, _tenses
+
+
+def write_synthetic(directory: str, clips=4, chords=6, seconds=2., bitrate=48100, kinds=('maj', 'm'),
+                    seed=0) -> list:
+    # 16-bit wav clips of random triad progressions with their csv labels, returns the clip paths
+    _paths = []
+    _kinds = [kind for kind in kinds if kind in TRIADS]
+    for clip in range(clips):
+        _path = os_path.join(directory, 'synthetic-%02d.wav' % clip)
+        _size = int(seconds * bitrate)
+        _rows = ['time,root,tense']
+        with open_wave(_path, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(bitrate)
+            for i in range(chords):
+                _seed = seed + clip * chords + i
+                # A1 to the octave below C8, like the benchmark suite
+                _semitone = -36 + (_seed * 7) % 66
+                _kind = _kinds[_seed % len(_kinds)]
+                _rows.append('%.4f,%s,%s' % (i * seconds, ROOTS[_semitone % 12], _kind))
+                w.writeframes(synth_triad(_semitone, _kind, _size, bitrate, seed=_seed).astype('<i2').tobytes())
+        with open(label_path(_path), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(_rows) + '\n')
+        _paths.append(_path)
+    logger.info('wrote %d synthetic clips to: %s', clips, directory)
+    return _paths
+
+
+def load_clip(path: str, raw=False, bitrate=48100, channels=1) -> tuple:
+    if raw:
+        return open_raw(path, channels), bitrate
+    return open_wav(path)
+
+
+def compute_spectra(task: tuple) -> dict:
+    # worker: the clip's spectra at unit gain, written once to a .npy every setting of the clip maps read only
+    #   gain only scales magnitudes, so one spectrum serves every gain
+    path, single_tail, target, window_size, hop_size, batch, load = task
+    _data, _bitrate = load_clip(path, **load)
+    # no gain: unit scale
+    _engine = SpectrumEngine(window_size, _bitrate, db_gain=0., single_tail=single_tail)
+    _frames = frame_view(_data, window_size, hop_size)
+    _x = _engine.frequencies()
+    _spectra = open_memmap(target, mode='w+', dtype=float64, shape=(len(_frames), len(_x)))
+    _start = perf_counter()
+    for _lower in range(0, len(_frames), batch):
+        _engine.transform_frames(_frames[_lower:_lower + batch], out=_spectra[_lower:_lower + batch])
+    _seconds = perf_counter() - _start
+    _spectra.flush()
+    _times = (arange(len(_frames), dtype=float64) * hop_size + window_size) / _bitrate
+    return {
+        'path': path,
+        'single_tail': single_tail,
+        'spectra': target,
+        'x': _x,
+        'frames': len(_frames),
+        'spectrum_s': _seconds,
+        'labels': label_frames(read_labels(label_path(path)), _times)
+    }
+
+
+def evaluate_settings(task: tuple) -> list:
+    # worker: every (threshold, gain) of `settings` over one clip's shared spectra
+    clip, settings, templates = task
+    _spectra = open_memmap(clip['spectra'], mode='r')
+    _x = clip['x']
+    _roots, _tenses = clip['labels']
+    _filter = TemplateFilter if templates else TriadFilter
+    _y = empty(_spectra.shape[1], dtype=float64)
+    _index = empty(len(_spectra), dtype=int8)
+    _tense = empty(len(_spectra), dtype=int8)
+    _results = []
+    for threshold, gain in settings:
+        triad = _filter(threshold=float(threshold))
+        _start = perf_counter()
+        for i, row in enumerate(_spectra):
+            multiply(row, gain, out=_y)
+            triad.update(_x, _y)
+            _index[i], _tense[i] = triad.get_chord()
+        _seconds = perf_counter() - _start
+        _root_hits = _index == _roots
+        _results.append({
+            'threshold': threshold,
+            'db_gain': gain,
+            'single_tail': clip['single_tail'],
+            'frames': len(_spectra),
+            'roots': int(_root_hits.sum()),
+            'chords': int((_root_hits & (_tense == _tenses)).sum()),
+            'filter_s': _seconds,
+            'spectrum_s': clip['spectrum_s']
+        })
+    return _results
+
+
+def pareto(results: list) -> list:
+    # flags the settings no other setting beats on both chord accuracy and throughput
+    for result in results:
+        result['pareto'] = not any(
+            other['chord_accuracy'] >= result['chord_accuracy'] and other['fps'] >= result['fps'] and
+            (other['chord_accuracy'] > result['chord_accuracy'] or other['fps'] > result['fps'])
+            for other in results)
+    return results
+
+
+class ParameterSweep:
+    # fft -> chord filter over a labeled corpus for every (threshold, gain, single tail) setting:
+    #   spectra are computed once per clip and tail, then settings are scored in chunks across a process pool
+    #   accuracy counts frames whose decided chord matches the label in force, throughput is the end to end
+    #   frames per second of one core, spectrum included
+    def __init__(self, clips: list, thresholds=(2e+4,), gains=(1e-1,), single_tails=(False,), window_size=8192,
+                 hop_size=None, batch=256, templates=False, jobs=None, raw=False, bitrate=48100, channels=1):
+        self._clips = list(clips)
+        self._settings = list(product([float(t) for t in thresholds], [float(g) for g in gains]))
+        self._single_tails = list(single_tails)
+        self._window_size = int(window_size)
+        self._hop_size = int(hop_size or window_size)
+        self._batch = int(batch)
+        self._templates = templates
+        self._jobs = int(jobs or cpu_count() or 1)
+        self._load = {'raw': raw, 'bitrate': bitrate, 'channels': channels}
+        logger.info('sweep: %d clips, %d settings x %d tails on %d workers', len(self._clips),
+                    len(self._settings), len(self._single_tails), self._jobs)
+
+    def chunks(self, spectra: list) -> list:
+        # enough tasks to keep every worker busy, few enough that a task outlasts its spawn
+        _tasks = max(1, -(-2 * self._jobs // max(len(spectra), 1)))
+        _size = -(-len(self._settings) // min(_tasks, len(self._settings)))
+        return [(clip, self._settings[i:i + _size], self._templates)
+                for clip in spectra for i in range(0, len(self._settings), _size)]
+
+    def run(self) -> list:
+        _start = perf_counter()
+        with TemporaryDirectory(prefix='harmonics-sweep-') as directory, \
+                ProcessPoolExecutor(max_workers=self._jobs) as pool:
+            _tasks = [(path, tail, os_path.join(directory, '%d-%d.npy' % (i, tail)), self._window_size,
+                       self._hop_size, self._batch, self._load)
+                      for i, path in enumerate(self._clips) for tail in self._single_tails]
+            _spectra = list(pool.map(compute_spectra, _tasks))
+            logger.info('sweep: spectra of %d frames in %.2f s', sum(clip['frames'] for clip in _spectra),
+                        perf_counter() - _start)
+            _totals = dict()
+            for results in pool.map(evaluate_settings, self.chunks(_spectra)):
+                for result in results:
+                    _key = (result['threshold'], result['db_gain'], result['single_tail'])
+                    _total = _totals.setdefault(_key, dict.fromkeys(('frames', 'roots', 'chords', 'filter_s',
+                                                                     'spectrum_s'), 0))
+                    for name in _total:
+                        _total[name] += result[name]
+        _results = []
+        for (threshold, gain, single_tail), total in _totals.items():
+            _frames = max(total['frames'], 1)
+            _seconds = total['filter_s'] + total['spectrum_s']
+            _results.append({
+                'threshold': threshold,
+                'db_gain': gain,
+                'single_tail': single_tail,
+                'frames': total['frames'],
+                'root_accuracy': total['roots'] / _frames,
+                'chord_accuracy': total['chords'] / _frames,
+                'fps': total['frames'] / _seconds if _seconds else 0.,
+                'filter_ms': 1e3 * total['filter_s'] / _frames,
+                'spectrum_ms': 1e3 * total['spectrum_s'] / _frames
+            })
+        _results.sort(key=lambda r: (-r['chord_accuracy'], -r['fps']))
+        logger.info('sweep: %d settings in %.2f s', len(_results), perf_counter() - _start)
+        return pareto(_results)
+
+
+def write_results(results: list, stream, fmt='csv'):
+    _columns = ['threshold', 'db_gain', 'single_tail', 'frames', 'root_accuracy', 'chord_accuracy', 'fps',
+                'filter_ms', 'spectrum_ms', 'pareto']
+    if fmt == 'csv':
+        stream.write(','.join(_columns) + '\n')
+    for result in results:
+        if fmt == 'csv':
+            stream.write('%(threshold)g,%(db_gain)g,%(single_tail)d,%(frames)d,%(root_accuracy).4f,'
+                         '%(chord_accuracy).4f,%(fps).1f,%(filter_ms).4f,%(spectrum_ms).4f,%(pareto)d\n' % result)
+        else:
+            stream.write(dumps(result) + '\n')
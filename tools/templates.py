@@ -0,0 +1,87 @@
+from numpy import abs, argmax, ndarray, sort, sqrt, zeros
+from .filter import TriadFilter
+
+
+class TemplateFilter(TriadFilter):
+    # branch-free alternative to TriadFilter's interval rules:
+    #   spectrum -> 12 bin chroma -> cosine score of every (tense, root) triad template, all matrix products
+    #   results and colors stay compatible with TriadFilter, diminished / augmented share the minor / major colors
+    # the per-frame chord depends on the frame's chroma alone
+    chroma_only = True
+
+    def __init__(self, x=None, y=None, verbose=False, threshold=2e+4, decay=0.8, floor=1e-3):
+        super().__init__(verbose=verbose, threshold=threshold, decay=decay)
+        # semitones above the root, in the order of `_sound`
+        self._sound = [' m', ' maj', ' dim', ' aug']
+        _triads = [
+            (0, self._minor_3rd, self._dominant_5th),
+            (0, self._major_3rd, self._dominant_5th),
+            (0, self._minor_3rd, self._dominant_dim),
+            (0, self._major_3rd, self._dominant_5th + 1)
+        ]
+        _notes = len(self._roots)
+        # (tense * root, note) unit templates
+        self._templates = zeros((len(_triads) * _notes, _notes))
+        for tense, intervals in enumerate(_triads):
+            for root in range(_notes):
+                for interval in intervals:
+                    self._templates[tense * _notes + root, (root + interval) % _notes] = 1. / sqrt(len(intervals))
+        self._chord_scores = zeros((_notes, len(self._sound) + 1))
+        # frames with less chroma energy than `floor` of the threshold hold no chord
+        self._template_floor = float(floor) * self._magnitude
+        self._chroma = zeros(_notes)
+        self._scores = zeros(len(self._templates))
+        if x is not None and y is not None:
+            self.update(x, y)
+
+    def score(self, chroma: ndarray) -> tuple:
+        # (root index or -1, tense) per chroma row, tense counts from 1 as in get_chord
+        _norm = sqrt((chroma * chroma).sum(axis=-1))
+        _scores = chroma @ self._templates.T
+        _best = argmax(_scores, axis=-1)
+        _tense, _root = divmod(_best, len(self._roots))
+        _root = _root - (_root + 1) * (_norm <= self._template_floor)
+        return _root, _tense + 1
+
+    def margin(self) -> float:
+        # L1 change of the last chroma under which score() cannot pick another chord: every template score moves
+        # by at most the largest template weight times the change, the norm by at most the change
+        _scores = sort(self._chroma @ self._templates.T)
+        _norm = sqrt((self._chroma * self._chroma).sum())
+        return min(0.5 * (_scores[-1] - _scores[-2]) / self._templates.max(), abs(_norm - self._template_floor))
+
+    def filter(self) -> dict:
+        _root, _tense = self.score(self._chroma)
+        return self.set_chord(int(_root), int(_tense))
+
+    def evaluate(self, x: ndarray, y: ndarray) -> dict:
+        self.plan(x, y.size)
+        self.plan_chroma(x)
+        self._chroma = self.chroma(y)
+        return self.filter()
+
+    def evaluate_notes(self, x: ndarray, y: ndarray) -> dict:
+        self.plan_notes(x)
+        self.plan_chroma(x)
+        self._chroma = self.chroma(y)
+        return self.filter()
+
+    def evaluate_bands(self, bands: list) -> dict:
+        self.plan_bands(bands)
+        self._chroma = self.band_chroma(bands)
+        return self.filter()
+
+    def update_frames(self, x: ndarray, frames: ndarray) -> list:
+        # a (frames, bins) batch scored at once, only the decayed vote runs per frame
+        self.plan_chroma(x)
+        _roots, _tenses = self.score(self.chroma(frames))
+        return [self.decide(self.set_chord(int(root), int(tense))) for root, tense in zip(_roots, _tenses)]
+
+    def get_color(self) -> int:
+        # the LED sketch knows no diminished / augmented colors
+        _tense = self._tense
+        if self._tense in self._sound[2:]:
+            self._tense = self._sound[self._sound.index(self._tense) - 2]
+        _color = super().get_color()
+        self._tense = _tense
+        return _color
@@ -0,0 +1,82 @@
+from numpy import ceil, log2, percentile
+from time import perf_counter
+from .bench import synth_triad
+from .capture import NoteBankEngine, SpectrumEngine
+from .filter import TriadFilter
+from .log import logger
+from .templates import TemplateFilter
+
+
+def pow2(value: float) -> int:
+    return int(2 ** ceil(log2(max(value, 1.))))
+
+
+def note_gap(semitone: int, reference=440.0) -> float:
+    # Hz between `semitone` (counted from A4) and the semitone above it
+    return reference * 2 ** (semitone / 12.) * (2 ** (1 / 12.) - 1.)
+
+
+def resolving_window(bitrate: int, lowest=-36, bins_per_semitone=1.) -> int:
+    # smallest power of two frame with `bins_per_semitone` fft bins between the lowest note and its neighbour
+    return pow2(bins_per_semitone * bitrate / note_gap(lowest))
+
+
+def lowest_resolved(bitrate: int, window_size: int, bins_per_semitone=1.) -> int:
+    # lowest semitone from A4 still resolved by `window_size`
+    _gap = bins_per_semitone * bitrate / window_size
+    return int(ceil(12. * log2(_gap / (440.0 * (2 ** (1 / 12.) - 1.)))))
+
+
+def process_time(window_size: int, bitrate: int, threshold=2e+4, db_gain=1e-1, note_bins=False, templates=False,
+                 frames=50, warmup=5) -> float:
+    # 95th percentile seconds of spectrum and chord filter per frame, measured on this machine
+    _engine = NoteBankEngine(window_size, bitrate, db_gain=db_gain) if note_bins else \
+        SpectrumEngine(window_size, bitrate, db_gain=db_gain)
+    triad = (TemplateFilter if templates else TriadFilter)(threshold=float(threshold))
+    _update = triad.update_notes if note_bins else triad.update
+    _data = synth_triad(3, 'maj', window_size, bitrate)
+    _times = []
+    for i in range(warmup + frames):
+        _start = perf_counter()
+        _update(*_engine.transform(_data))
+        if i >= warmup:
+            _times.append(perf_counter() - _start)
+    return float(percentile(_times, 95))
+
+
+def geometry(window_size: int, bitrate=48100, min_buffer=256, headroom=2., **kwargs) -> dict:
+    # hop and capture buffer shrink until processing a hop takes no more than 1 / `headroom` of it
+    #   latency counts filling a frame, delivering a buffer and processing it
+    _process = process_time(window_size, bitrate, **kwargs)
+    _hop = min(window_size, max(pow2(headroom * _process * bitrate), pow2(min_buffer)))
+    return {
+        'bitrate': bitrate,
+        'window_size': window_size,
+        'hop_size': _hop,
+        'buffer_size': _hop,
+        'process_ms': 1e3 * _process,
+        'latency_ms': 1e3 * ((window_size + _hop) / float(bitrate) + _process)
+    }
+
+
+def autotune(bitrate=48100, budget_ms=250., lowest=-24, bins_per_semitone=1., min_buffer=256, headroom=2.,
+             **kwargs) -> dict:
+    # smallest geometry resolving `lowest` within `budget_ms`: the frame is fixed by the resolution, unless it
+    #   misses the budget, then it halves until it fits and the lowest note resolved rises with it
+    #   raises ValueError when not even a `min_buffer` frame fits
+    _window = resolving_window(bitrate, lowest, bins_per_semitone)
+    while True:
+        _results = geometry(_window, bitrate, min_buffer, headroom, **kwargs)
+        if _results['latency_ms'] <= budget_ms or _window <= pow2(min_buffer):
+            break
+        _window //= 2
+    if _results['latency_ms'] > budget_ms:
+        raise ValueError('autotune: %.1f ms latency with the smallest %d sample frame, over the %.1f ms budget' %
+                         (_results['latency_ms'], _window, budget_ms))
+    _results['lowest'] = lowest_resolved(bitrate, _window, bins_per_semitone)
+    logger.info('autotune: window %(window_size)d, hop %(hop_size)d, buffer %(buffer_size)d at %(bitrate)d, '
+                'process %(process_ms).3f ms, latency %(latency_ms).1f ms', _results)
+    if _results['lowest'] > lowest:
+        logger.warning('autotune: resolving semitone %d needs more than the %.1f ms budget, resolving down to '
+                       'semitone %d instead', lowest, budget_ms, _results['lowest'])
+    return _results